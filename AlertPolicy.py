@@ -0,0 +1,97 @@
+from typing import Sequence
+
+
+class AlertPolicy:
+    """
+    Decides how often a server is probed and when its alerts are notified: exponential backoff while a server stays
+    down, faster probes while a state change is being confirmed, flap detection with hysteresis and the notification
+    thresholds
+    """
+
+    def __init__(self, backoff_factor: float = 2, backoff_max: float = 600, confirm_interval: float = 5,
+                 down_checks: int = 1, recovery_checks: int = 1, flap_window: int = 20, flap_high: float = 0.5,
+                 flap_low: float = 0.25, notify_first: int = 1, notify_every: int = 10, notify_flapping: bool = True):
+        """
+        :param backoff_factor: the interval grows by this factor with every failed check while a server is down
+            (1 disables backoff)
+        :param backoff_max: seconds, the longest interval backoff leads to (never shorter than the server interval)
+        :param confirm_interval: seconds between checks while a failure or a recovery is being confirmed
+        :param down_checks: consecutive failed checks before a server is down
+        :param recovery_checks: consecutive successful checks before a down server is up again
+        :param flap_window: the number of recent checks flapping is measured over
+        :param flap_high: a server starts flapping when this fraction of the recent checks changed state
+            (0 disables flap detection)
+        :param flap_low: and stops flapping when the fraction drops below this
+        :param notify_first: the failed check (alert count) the first down notification is sent at
+        :param notify_every: repeat the down notification every this many failed checks (0 = never)
+        :param notify_flapping: notify when flapping starts and stops, down/up notifications are held while flapping
+        """
+        self.backoff_factor = max(1.0, float(backoff_factor))
+        self.backoff_max = float(backoff_max)
+        self.confirm_interval = float(confirm_interval)
+        self.down_checks = max(1, int(down_checks))
+        self.recovery_checks = max(1, int(recovery_checks))
+        self.flap_window = max(2, int(flap_window))
+        self.flap_high = float(flap_high)
+        self.flap_low = min(float(flap_low), self.flap_high)
+        self.notify_first = max(1, int(notify_first))
+        self.notify_every = max(0, int(notify_every))
+        self.notify_flapping = bool(notify_flapping)
+
+    def with_overrides(self, **settings) -> 'AlertPolicy':
+        """
+        :return: a copy of this policy with some settings replaced (per server settings)
+        """
+        return AlertPolicy(**{**vars(self), **settings})
+
+    def should_notify(self, alert_count: int) -> bool:
+        return alert_count == self.notify_first or bool(self.notify_every) and alert_count % self.notify_every == 0
+
+    def backoff(self, interval: float, alert_count: int) -> float:
+        """
+        :return: the interval after the given number of failed checks
+        """
+        if self.backoff_factor == 1 or alert_count <= 1:
+            return interval
+        # the exponent is capped so the float cannot overflow, backoff_max is reached long before
+        return max(interval, min(interval * self.backoff_factor ** min(alert_count - 1, 64), self.backoff_max))
+
+    def next_interval(self, interval: float, alert: bool, alert_count: int, confirming: bool, flapping: bool) -> float:
+        """
+        :param interval: the configured interval of the server
+        :param alert: the server is down
+        :param alert_count: the number of failed checks since it went down
+        :param confirming: a failure (while up) or a recovery (while down) has to be confirmed
+        :param flapping: the server is flapping
+        :return: seconds until the next check
+        """
+        if flapping:
+            return interval
+        if confirming:
+            return min(self.confirm_interval, interval)
+        if alert:
+            return self.backoff(interval, alert_count)
+        return interval
+
+    @staticmethod
+    def change_ratio(results: Sequence[bool]) -> float:
+        """
+        :return: the fraction of checks that had a different result than the check before
+        """
+        if len(results) < 2:
+            return 0.0
+        changes = sum(1 for a, b in zip(results, list(results)[1:]) if a != b)
+        return changes / (len(results) - 1)
+
+    def is_flapping(self, flapping: bool, results: Sequence[bool]) -> bool:
+        """
+        :param flapping: the server was flapping before
+        :param results: the recent check results, oldest first
+        :return: the server is flapping now
+        """
+        if not self.flap_high:
+            return False
+        if len(results) < self.flap_window:
+            return flapping  # not enough checks yet
+        ratio = self.change_ratio(results)
+        return ratio >= self.flap_low if flapping else ratio >= self.flap_high
@@ -0,0 +1,234 @@
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Sequence
+
+try:
+    import numpy
+except ImportError:  # the columns work without numpy, transitions are then evaluated row by row
+    numpy = None
+
+
+@lru_cache(maxsize=1024)
+def format_time(epoch: int, timestamp_format: str) -> str:
+    # the servers of one cycle share a handful of timestamps, each is formatted once
+    return datetime.fromtimestamp(epoch).strftime(timestamp_format)
+
+
+class StateField:
+    """
+    A server's alert state attribute. Kept in the server's own slot, or in the alert store when the server has a row
+    """
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+        self.slot = f"_{name}"
+
+    def __get__(self, server, owner=None):
+        if server is None:
+            return self
+        if server.row is None:
+            return getattr(server, self.slot)
+        return server.alert_store.get(self.name, server.row, server.timestamp_format)
+
+    def __set__(self, server, value):
+        if server.row is None:
+            setattr(server, self.slot, value)
+        else:
+            server.alert_store.set(self.name, server.row, value, server.timestamp_format)
+
+
+class AlertStore:
+    """
+    The alert state of all servers in parallel columns (one row per server) instead of one object each: alert flags,
+    counts, start/last alert times as epoch seconds and the last status. evaluate() applies one cycle of check results
+    to all rows at once, vectorized with numpy when it is installed
+    """
+    # column: (array type code, numpy dtype name)
+    columns = {
+        "alert": ("b", "int8"),  # -1 = never checked, 0 = up, 1 = down
+        "alert_count": ("i", "int32"),
+        "alert_start": ("q", "int64"),  # epoch seconds, 0 = none
+        "last_alert": ("q", "int64"),
+        "last_status": ("b", "int8"),  # result of the last check: -1 = none, 0 = failed, 1 = succeeded
+        "fail_streak": ("i", "int32"),
+        "recovery_count": ("i", "int32"),
+        # the policy settings the transitions depend on, per row because servers may override them
+        "down_checks": ("i", "int32"),
+        "recovery_checks": ("i", "int32"),
+        "notify_first": ("i", "int32"),
+        "notify_every": ("i", "int32"),
+    }
+    times = ("alert_start", "last_alert")
+
+    def __init__(self):
+        self._data: Dict[str, array] = {name: array(code) for name, (code, _) in self.columns.items()}
+        self._free: List[int] = []  # rows of removed servers, reused before the columns grow
+
+    def __len__(self):
+        """
+        :return: the number of rows, including free ones
+        """
+        return len(self._data["alert"])
+
+    @property
+    def free(self) -> int:
+        """
+        :return: the number of rows waiting to be reused
+        """
+        return len(self._free)
+
+    def add(self, policy) -> int:
+        """
+        :param policy: the server's AlertPolicy
+        :return: the new row, a free one if there is one
+        """
+        if self._free:
+            row = self._free.pop()
+            for name, column in self._data.items():
+                column[row] = -1 if name in ("alert", "last_status") else 0
+        else:
+            row = len(self)
+            for name, column in self._data.items():
+                column.append(-1 if name in ("alert", "last_status") else 0)
+        self.set_policy(row, policy)
+        return row
+
+    def set_policy(self, row: int, policy):
+        """
+        Replace the policy settings of a row, its state is kept
+        :param policy: the server's AlertPolicy
+        """
+        for name in ("down_checks", "recovery_checks", "notify_first", "notify_every"):
+            self._data[name][row] = getattr(policy, name)
+
+    def remove(self, row: int):
+        """
+        Free a row for the next server that is added
+        """
+        self._free.append(row)
+
+    def get(self, name: str, row: int, timestamp_format: str):
+        """
+        :return: a column value the way SerMon keeps it (None, bool, int or a formatted timestamp)
+        """
+        value = self._data[name][row]
+        if name == "alert":
+            return None if value < 0 else bool(value)
+        if name in self.times:
+            return format_time(value, timestamp_format) if value else None
+        return value
+
+    def set(self, name: str, row: int, value, timestamp_format: str):
+        if name == "alert":
+            value = -1 if value is None else int(bool(value))
+        elif name in self.times:
+            value = self._epoch(value, timestamp_format)
+        else:
+            value = int(value) if str(value).isnumeric() else 0
+        self._data[name][row] = value
+
+    @staticmethod
+    def _epoch(value, timestamp_format: str) -> int:
+        if not value:
+            return 0
+        if isinstance(value, datetime):
+            return int(value.timestamp())
+        try:
+            return int(datetime.strptime(str(value), timestamp_format).timestamp())
+        except ValueError:
+            return 0  # written with another timestamp_format
+
+    def evaluate(self, rows: Sequence[int], success: Sequence[bool], times: Sequence[int]) -> Dict[str, List[bool]]:
+        """
+        Apply one check result per row, with the same transitions as SerMon._process_result
+        :param rows: the rows that were checked
+        :param success: the check results, in the same order
+        :param times: the epoch seconds each check started at, in the same order
+        :return: masks in the order of rows: down (went down), up (recovered), notify (a down notification is due,
+            only on failed checks) and changed (the journal fields changed)
+        """
+        if numpy is not None:
+            return self._evaluate_numpy(rows, success, times)
+        return self._evaluate_rows(rows, success, times)
+
+    def _evaluate_numpy(self, rows: Sequence[int], success: Sequence[bool],
+                        times: Sequence[int]) -> Dict[str, List[bool]]:
+        # views on the columns, the columns cannot grow while they exist
+        view = {name: numpy.frombuffer(self._data[name], dtype) if len(self) else numpy.zeros(0, dtype)
+                for name, (_, dtype) in self.columns.items()}
+        index = numpy.asarray(rows, dtype=numpy.intp)
+        ok = numpy.asarray(success, dtype=bool)
+        now = numpy.asarray(times, dtype=numpy.int64)
+        alert, count = view["alert"][index], view["alert_count"][index]
+        start, last = view["alert_start"][index], view["last_alert"][index]
+        old_streak, old_recovery = view["fail_streak"][index], view["recovery_count"][index]
+        was_down = alert == 1
+
+        streak = numpy.where(~ok & ~was_down, old_streak + 1, old_streak)
+        down = ~ok & ~was_down & (streak >= view["down_checks"][index])
+        recovery = numpy.where(ok & was_down, old_recovery + 1, old_recovery)
+        up = ok & was_down & (recovery >= view["recovery_checks"][index])
+        still_down = ~ok & was_down
+
+        new_alert = numpy.where(down, 1, numpy.where(up, 0, alert)).astype(numpy.int8)
+        new_count = numpy.where(down, 1, numpy.where(still_down, count + 1, count)).astype(numpy.int32)
+        new_start = numpy.where(down, now, start)
+        new_last = numpy.where(down | still_down, now, last)
+        streak = numpy.where(down | ok, 0, streak)
+        recovery = numpy.where(down | up | still_down, 0, recovery)
+
+        every = view["notify_every"][index]
+        notify = ~ok & (new_alert == 1) & ((new_count == view["notify_first"][index]) |
+                                           (every > 0) & (new_count % numpy.maximum(every, 1) == 0))
+        changed = ((new_alert != alert) | (new_count != count) | (new_start != start) | (new_last != last) |
+                   (streak != old_streak) | (recovery != old_recovery))
+
+        view["alert"][index] = new_alert
+        view["alert_count"][index] = new_count
+        view["alert_start"][index] = new_start
+        view["last_alert"][index] = new_last
+        view["last_status"][index] = ok
+        view["fail_streak"][index] = streak
+        view["recovery_count"][index] = recovery
+        del view
+        return {"down": down.tolist(), "up": up.tolist(), "notify": notify.tolist(), "changed": changed.tolist()}
+
+    def _evaluate_rows(self, rows: Sequence[int], success: Sequence[bool],
+                       times: Sequence[int]) -> Dict[str, List[bool]]:
+        data = self._data
+        masks = {"down": [], "up": [], "notify": [], "changed": []}
+        for row, ok, now in zip(rows, success, times):
+            alert, count = data["alert"][row], data["alert_count"][row]
+            start, last = data["alert_start"][row], data["last_alert"][row]
+            old_streak = streak = data["fail_streak"][row]
+            old_recovery = recovery = data["recovery_count"][row]
+            down = up = False
+            new_alert, new_count, new_start, new_last = alert, count, start, last
+            if not ok and alert != 1:
+                streak += 1
+                if streak >= data["down_checks"][row]:
+                    down = True
+                    new_alert, new_count, new_start, new_last = 1, 1, now, now
+                    streak = recovery = 0
+            elif ok and alert == 1:
+                recovery += 1
+                if recovery >= data["recovery_checks"][row]:
+                    up = True
+                    new_alert, recovery = 0, 0
+            elif not ok and alert == 1:
+                new_count, new_last, recovery = count + 1, now, 0
+            if ok:
+                streak = 0
+            every = data["notify_every"][row]
+            masks["down"].append(down)
+            masks["up"].append(up)
+            masks["notify"].append(not ok and new_alert == 1 and (new_count == data["notify_first"][row] or
+                                                                  every > 0 and new_count % every == 0))
+            masks["changed"].append((new_alert, new_count, new_start, new_last, streak, recovery) !=
+                                    (alert, count, start, last, old_streak, old_recovery))
+            data["alert"][row], data["alert_count"][row] = new_alert, new_count
+            data["alert_start"][row], data["last_alert"][row] = new_start, new_last
+            data["last_status"][row] = int(ok)
+            data["fail_streak"][row], data["recovery_count"][row] = streak, recovery
+        return masks
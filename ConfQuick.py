@@ -1,16 +1,33 @@
-from typing import Optional
-from benedict import benedict as bd
-from dotty_dict.dotty_dict import dotty
+from typing import Optional, Tuple
+from functools import lru_cache
+import copy
+import hashlib
+import json
 import os
+import pickle
 import re
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
+def _benedict():
+    # imported on first use, a configuration loaded from its snapshot never needs benedict or yaml
+    from benedict import benedict
+    return benedict
+
+
+# key paths are resolved by ConfQuick itself, benedict only reads and writes the file. Without a separator keys may
+# contain dots (e.g. a journal entry for db.example.com, set as 'journal.db\.example\.com')
+_NO_KEYPATH = {"keypath_separator": None}
+
+
 class ConfQuick:
+    snapshot_version = 1  # bump when the snapshot layout or the merge rules change
+
     def __init__(self, app_name: str = "general", default_defs: Optional[dict] = None,
                  notes: Optional[dict] = None, custom_file_path: str = None,
-                 django=False, debug=False):
+                 django=False, debug=False, snapshot=True):
         """
         Initialize and load the ConfQuick object. if no arguments are supplied, example values will be used
         :param app_name: used to generate config file names, examples and the initial django secret key
@@ -18,13 +35,16 @@ class ConfQuick:
         :param notes: for generating documentation. same structure as above, but only allows string values
         :param custom_file_path: by default, the file name is generated from the app name and placed in the base folder
         :param django: True if the config file is meant for use by django. (Auto-generates a secret key)
+        :param snapshot: keep a merged and template-resolved copy of the file next to it (.{file name}.snapshot)
+            and load that instead of parsing and merging the file again while the file has not changed
         """
         self.debug = debug
+        self.snapshot = snapshot
         if type(custom_file_path) is not str:
             self.conf_file = f"{BASE_DIR}/{app_name}-conf.yaml"
         else:
             self.conf_file = custom_file_path
-        self.conf = bd()
+        self.conf = {}
         self.default_conf = default_defs if type(default_defs) is dict else {
             f'{app_name}': {
                 'server_name': 'example',
@@ -41,8 +61,7 @@ class ConfQuick:
         } if app_name == 'general' else {}
         self.conf_notes = notes if type(notes) is dict else {}
         if os.path.exists(self.conf_file):
-            self._conf = bd.from_yaml(self.conf_file)
-            result = self.apply(merge=True)
+            result = self._load()
             if self.debug:
                 print(f"Loaded {self.conf_file.split('/')[-1]}!")
                 if result:
@@ -51,7 +70,7 @@ class ConfQuick:
         else:
             if self.debug:
                 print("Configuration file not found.")
-            self._conf = bd(self.default_conf)
+            self._conf = copy.deepcopy(self.default_conf)
             self.apply(merge=False)
 
         # finally, check for the django secret key
@@ -81,8 +100,10 @@ class ConfQuick:
         :param cast_as_type: if we are casting, the type of the default value is used to ensure the correct type
         :return: the desired value
         """
-        cfg = dotty(self.conf.dict())
-        value = cfg.get(key_path, default)
+        try:
+            value = self._find(self.conf, self._split_key_path(key_path))
+        except (KeyError, IndexError):
+            value = default
         if cast_as_type is False or default is None:
             return value
         elif type(default) is str:
@@ -126,20 +147,205 @@ class ConfQuick:
         :param apply: the values are only in self._conf unless applied (disabling saves time if updating multiple keys)
         :return: nothing
         """
-        cfg = dotty(self._conf.dict())
-        cfg[key_path] = value
-        self._conf = bd(cfg)
+        keys = self._split_key_path(key_path)
+        data = self._conf
+        for key in keys[:-1]:
+            # a missing node is always created as a dict, digits only index lists that already exist
+            if type(data) is list and key.isdigit():
+                if int(key) >= len(data) or not data[int(key)]:
+                    self._set_list_index(data, int(key), {})
+                data = data[int(key)]
+            else:
+                key = self._dict_key(data, key)
+                if not data.get(key):
+                    data[key] = {}
+                data = data[key]
+        if type(data) is list and keys[-1].isdigit():
+            self._set_list_index(data, int(keys[-1]), value)
+        else:
+            data[self._dict_key(data, keys[-1])] = value
         if apply:
             self.apply()
 
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _split_key_path(key_path) -> Tuple[str, ...]:
+        """
+        Split a dotty-dict-formatted key path into its keys ('\\.' escapes a dot that is part of a key name)
+        :param key_path: the key path (ex: 'cfg.my_key_name' or 'cfg.my_list_key.3')
+        :return: a tuple of keys -- parsed paths are cached, they are looked up far more often than they change
+        """
+        if type(key_path) is not str:
+            return key_path,
+        return tuple(k.replace('<#esc#>', '.') for k in key_path.replace('\\.', '<#esc#>').split('.'))
+
+    @staticmethod
+    def _dict_key(data: dict, key):
+        """
+        :return: the key as stored in data -- yaml loads numeric keys (e.g. a server named 8080) as int
+        """
+        if key not in data and type(key) is str and key.lstrip('-').isdigit() and int(key) in data:
+            return int(key)
+        return key
+
+    @staticmethod
+    def _find(data, keys: Tuple[str, ...]):
+        """
+        Walk the configuration tree in place -- only the nodes along the path are visited, nothing is copied
+        :param data: the dictionary (or list) to start from
+        :param keys: the keys returned by _split_key_path
+        :return: the value at the location, raises KeyError or IndexError if it does not exist
+        """
+        for key in keys:
+            if type(data) is list and type(key) is str and key.isdigit():
+                data = data[int(key)]
+            elif isinstance(data, dict):
+                data = data[ConfQuick._dict_key(data, key)]
+            else:
+                raise KeyError(key)
+        return data
+
+    @staticmethod
+    def _set_list_index(data: list, index: int, value):
+        """
+        Set a list item, padding the list with None values if it is too short
+        """
+        for _ in range(len(data), index + 1):
+            data.append(None)
+        data[index] = value
+
+    @staticmethod
+    def _replace_file(path: str, data: bytes) -> Tuple[int, int, str]:
+        """
+        Write a file atomically (temporary file + rename), keeping the permissions of the file it replaces
+        :return: modification time (ns), size and sha1 of the written file
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+            stat = os.stat(temp_path)  # the rename keeps the time
+            os.replace(temp_path, path)
+            return stat.st_mtime_ns, stat.st_size, hashlib.sha1(data).hexdigest()
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    @staticmethod
+    def _json_default(obj):
+        # the same conversions benedict applies before writing yaml
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        if hasattr(obj, "isoformat"):
+            return obj.isoformat()
+        return str(obj)
+
     def save(self, config_file=None):
         """
-        Save current configuration to a file
+        Save current configuration to a file. The file is replaced atomically, readers never see a partial file
         :param config_file: the file path
         """
         if config_file is None:
             config_file = self.conf_file
-        self._conf.to_yaml(filepath=config_file)
+        # the data exactly as it will read back from the file
+        data = json.loads(json.dumps(self._conf, default=self._json_default))
+        source = self._replace_file(config_file, _benedict()(data, **_NO_KEYPATH).to_yaml().encode())
+        if config_file == self.conf_file:
+            self._write_snapshot(source, data, None, [])
+
+    def reload(self):
+        """
+        Re-read the configuration file, discarding any changes that were not saved
+        :return: the results of the merge, an empty list if the file does not exist
+        """
+        if not os.path.exists(self.conf_file):
+            return []
+        return self._load()
+
+    def _load(self) -> list:
+        """
+        Load the configuration file, from the snapshot if it is still current
+        :return: the results of the merge
+        """
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            self._conf = snapshot['raw']
+            if snapshot['applied'] is not None:
+                self.conf = snapshot['applied']
+                return snapshot['result']
+            # written by save(), the file did not have to be parsed but still needs to be merged
+            result = self.apply(merge=True)
+            self._write_snapshot(snapshot['source'], self._conf, self.conf, result)
+            return result
+        source = self._source_key() if self.snapshot else None  # before parsing, a later change invalidates it
+        self._conf = _benedict().from_yaml(self.conf_file, **_NO_KEYPATH).dict()
+        result = self.apply(merge=True)
+        self._write_snapshot(source, self._conf, self.conf, result)
+        return result
+
+    @property
+    def snapshot_file(self) -> str:
+        directory, name = os.path.split(self.conf_file)
+        return os.path.join(directory, f".{name}.snapshot")
+
+    def _source_key(self) -> Tuple[int, int, str]:
+        """
+        :return: modification time (ns), size and sha1 of the configuration file
+        """
+        with open(self.conf_file, "rb") as f:
+            stat = os.fstat(f.fileno())
+            return stat.st_mtime_ns, stat.st_size, hashlib.sha1(f.read()).hexdigest()
+
+    def _defaults_key(self) -> str:
+        return hashlib.sha1(pickle.dumps(self.default_conf, pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def _read_snapshot(self) -> Optional[dict]:
+        """
+        :return: the snapshot if it was taken from the current file with the current defaults, None otherwise
+        """
+        if not self.snapshot:
+            return None
+        try:
+            stat = os.stat(self.conf_file)
+            with open(self.snapshot_file, "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('version') != self.snapshot_version or snapshot.get('defaults') != self._defaults_key():
+                return None
+            if snapshot['source'][:2] != (stat.st_mtime_ns, stat.st_size):
+                # touched or copied without changes, only the time differs
+                source = self._source_key()
+                if source[1:] != snapshot['source'][1:]:
+                    return None
+                snapshot['source'] = source
+                self._replace_file(self.snapshot_file, pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+            return snapshot
+        except Exception:
+            # missing, unreadable or from an incompatible version: parse the file
+            return None
+
+    def _write_snapshot(self, source: Optional[Tuple[int, int, str]], raw: dict, applied: Optional[dict],
+                        result: list):
+        """
+        Store the parsed (and merged) configuration for the next load. The snapshot is a pickle,
+        it is as trusted as the configuration file and the code next to it
+        :param source: the _source_key() of the file the data was read from
+        :param raw: the data as parsed from the file
+        :param applied: the merged and template-resolved data, None if it still has to be merged
+        """
+        if not self.snapshot or source is None:
+            return
+        try:
+            snapshot = {'version': self.snapshot_version, 'defaults': self._defaults_key(),
+                        'source': source, 'raw': raw, 'applied': applied, 'result': result}
+            self._replace_file(self.snapshot_file, pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            pass  # e.g. a read-only folder, the next load parses the file again
 
     def apply(self, merge=True):
         """
@@ -150,11 +356,10 @@ class ConfQuick:
         temp_conf = self.default_conf.copy()
         result = []
         if merge:
-            temp_c_dict = self._conf.dict()
+            temp_c_dict = self._conf
             temp_conf, result = self._verify_merge("", temp_conf, temp_c_dict, [])
             temp_conf.update(temp_c_dict)
-        temp_conf = self._update_template_vars(temp_conf)
-        self.conf = bd(temp_conf)
+        self.conf = self._update_template_vars(temp_conf)
         return result
 
     def _return_template_value(self, value_in, full_dict_obj: dict):
@@ -205,11 +410,9 @@ class ConfQuick:
         :param full_dict_obj: the dictionary to traverse
         :return: the value at the location (strings only)
         """
-        from dotty_dict.dotty_dict import dotty
-
         key_path = template_tag.replace("{", "").replace("}", "")
-        cfg = dotty(full_dict_obj)
-        return str(cfg[key_path]) if as_str else cfg[key_path]
+        value = ConfQuick._find(full_dict_obj, ConfQuick._split_key_path(key_path))
+        return str(value) if as_str else value
 
     def _verify_merge(self, path, dict_obj: dict, comp_dict_obj: dict, result: list):
         """
@@ -0,0 +1,96 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+from typing import Optional, Set, Tuple
+
+
+class ConfWatcher:
+    """
+    Tells when a file has changed. Uses inotify on linux (the folder is watched because editors and atomic saves
+    replace the file) and falls back to comparing the modification time and size everywhere else
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    _event = struct.Struct("iIII")  # wd, mask, cookie, len (followed by the name)
+
+    def __init__(self, path: str):
+        """
+        :param path: the file to watch
+        """
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path)
+        self._stat = self._stat_key()
+        self._fd: Optional[int] = None
+        self._inotify()
+
+    def _stat_key(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _inotify(self):
+        if not hasattr(os, "O_NONBLOCK"):
+            return  # windows
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        except (OSError, AttributeError):
+            return  # not linux
+        if fd < 0:
+            return
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+            os.close(fd)
+            return
+        self._fd = fd
+
+    def fileno(self) -> Optional[int]:
+        """
+        :return: a descriptor that becomes readable when the folder changes (inotify), None when polling
+        """
+        return self._fd
+
+    def _read_events(self) -> Set[str]:
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return names
+                raise
+            if not data:
+                return names
+            offset = 0
+            while offset + self._event.size <= len(data):
+                _, mask, _, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                if mask & self.IN_Q_OVERFLOW:
+                    names.add(self.name)  # events were lost, check the file
+                names.add(data[offset:offset + length].split(b"\0", 1)[0].decode(errors="replace"))
+                offset += length
+
+    def changed(self) -> bool:
+        """
+        :return: True if the file was changed, created or removed since the last call
+        """
+        if self._fd is not None and self.name not in self._read_events():
+            return False
+        key = self._stat_key()
+        if key == self._stat:
+            return False
+        self._stat = key
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
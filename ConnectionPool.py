@@ -0,0 +1,175 @@
+import asyncio
+import time
+from typing import Dict, Hashable, List, Optional
+from TlsClient import AsyncTlsStream
+
+
+class Connection:
+    """
+    An open connection to a target, plain or TLS, with buffered reads for line based protocols
+    """
+    read_size = 65536
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 tls: Optional[AsyncTlsStream] = None):
+        """
+        :param reader: the stream reader
+        :param writer: the stream writer
+        :param tls: the TLS stream on top of reader and writer, None for plain connections
+        """
+        self.reader = reader
+        self.writer = writer
+        self.tls = tls
+        self.loop = asyncio.get_running_loop()
+        self.idle_since = 0.0
+        self._buffer = bytearray()
+
+    @property
+    def usable(self) -> bool:
+        """
+        False once either side closed the connection
+        """
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: bytes received but not read yet
+        """
+        return len(self._buffer) + (self.tls.pending if self.tls is not None else 0)
+
+    async def _fill(self) -> bool:
+        data = await (self.tls.read(self.read_size) if self.tls is not None else self.reader.read(self.read_size))
+        self._buffer += data
+        return bool(data)
+
+    async def read_some(self) -> bytes:
+        """
+        :return: the data received so far or the next data to arrive, b"" once the peer closed the connection
+        """
+        if not self._buffer:
+            await self._fill()
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    async def readline(self, limit: int = 65536) -> bytes:
+        """
+        :return: the next line including its line break
+        """
+        while True:
+            end = self._buffer.find(b"\n")
+            if end >= 0:
+                line = bytes(self._buffer[:end + 1])
+                del self._buffer[:end + 1]
+                return line
+            if len(self._buffer) > limit:
+                raise ValueError(f"line longer than {limit} bytes")
+            if not await self._fill():
+                raise ConnectionResetError("connection closed by the peer")
+
+    async def readexactly(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            if not await self._fill():
+                raise ConnectionResetError("connection closed by the peer")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def write(self, data: bytes):
+        if self.tls is not None:
+            await self.tls.write(data)
+        else:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def close(self):
+        if self.tls is not None:
+            await self.tls.close()
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def abort(self):
+        """
+        Drop the connection without a goodbye (no error if its event loop is gone)
+        """
+        try:
+            self.writer.transport.abort()
+        except RuntimeError:
+            pass
+
+
+class ConnectionPool:
+    """
+    Connections left open after a check, so the next check of the same target skips the TCP and TLS setup. Only
+    probes that leave the connection in a known state (e.g. HTTP keep-alive) hand theirs back. Connections belong to
+    the event loop that opened them
+    """
+
+    def __init__(self, max_idle: int = 2, idle_timeout: float = 30):
+        """
+        :param max_idle: idle connections kept per target (0 disables reuse)
+        :param idle_timeout: seconds an idle connection is kept, keep it below the servers' keep-alive timeout
+        """
+        self.max_idle = max(0, int(max_idle))
+        self.idle_timeout = float(idle_timeout)
+        self._idle: Dict[Hashable, List[Connection]] = {}
+
+    def __len__(self):
+        return sum(len(idle) for idle in self._idle.values())
+
+    def acquire(self, key: Hashable) -> Optional[Connection]:
+        """
+        :param key: identifies the target
+        :return: the most recently used idle connection to the target, None if there is none
+        """
+        idle = self._idle.get(key)
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            if conn.loop is loop and conn.usable and now - conn.idle_since < self.idle_timeout:
+                return conn
+            conn.abort()
+        self._idle.pop(key, None)
+        return None
+
+    def release(self, key: Hashable, conn: Connection):
+        """
+        Keep a connection for the next check of the target, or close it when it cannot be reused
+        """
+        if not self.max_idle or not conn.usable or conn.pending:
+            conn.abort()
+            return
+        conn.idle_since = time.monotonic()
+        idle = self._idle.setdefault(key, [])
+        idle.append(conn)
+        while len(idle) > self.max_idle:
+            idle.pop(0).abort()
+
+    def prune(self):
+        """
+        Close the connections that were idle for too long or were closed by the peer
+        """
+        now = time.monotonic()
+        for key in list(self._idle):
+            keep = []
+            for conn in self._idle[key]:
+                if conn.usable and now - conn.idle_since < self.idle_timeout:
+                    keep.append(conn)
+                else:
+                    conn.abort()
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def close(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.abort()
+        self._idle = {}
@@ -0,0 +1,59 @@
+import bisect
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Every node owns many points (replicas) on the ring, so adding or removing
+    a node only moves the keys next to its points and the load stays even. Hashes are stable across processes
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64):
+        """
+        :param nodes: the initial nodes
+        :param replicas: the number of points per node
+        """
+        self.replicas = max(1, int(replicas))
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                del self._points[bisect.bisect_left(self._points, point)]
+
+    def node_for(self, key: str) -> Optional[str]:
+        """
+        :return: the node that owns the key, None if the ring is empty
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,194 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+HOUR = 3600
+DAY = 86400
+
+
+class History:
+    """
+    Append-only check history in SQLite (WAL mode, or a rollback journal when the file is shared). Results are
+    buffered and inserted in one transaction per flush, hourly/daily rollups and outage incidents are maintained on
+    insert so uptime and MTTR queries never have to scan the raw rows
+    """
+    periods = (HOUR, DAY)
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS checks (
+            ts INTEGER NOT NULL, server TEXT NOT NULL, success INTEGER NOT NULL, latency_ms REAL);
+        CREATE INDEX IF NOT EXISTS checks_server_ts ON checks (server, ts);
+        CREATE INDEX IF NOT EXISTS checks_ts ON checks (ts);
+        CREATE TABLE IF NOT EXISTS rollups (
+            server TEXT NOT NULL, period INTEGER NOT NULL, bucket INTEGER NOT NULL,
+            checks INTEGER NOT NULL, up INTEGER NOT NULL, latency_sum REAL NOT NULL, latency_count INTEGER NOT NULL,
+            PRIMARY KEY (server, period, bucket));
+        CREATE TABLE IF NOT EXISTS incidents (
+            server TEXT NOT NULL, start_ts INTEGER NOT NULL, end_ts INTEGER);
+        CREATE INDEX IF NOT EXISTS incidents_server_start ON incidents (server, start_ts);
+    """
+
+    def __init__(self, path: str, retention_days: float = 90, shared: bool = False):
+        """
+        :param path: the database file
+        :param retention_days: raw checks older than this are removed by prune() (rollups and incidents are kept)
+        :param shared: the file is used by several nodes (e.g. on a network filesystem). WAL needs memory shared on
+            one host, so a rollback journal is used instead
+        """
+        self.path = path
+        self.retention_days = float(retention_days)
+        self._db = sqlite3.connect(path, timeout=30 if shared else 5, check_same_thread=False)
+        self._db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.schema)
+        self._buffer: List[Tuple[int, str, int, Optional[float]]] = []
+        self._lock = threading.Lock()
+        self._open: Dict[str, int] = {}  # servers that currently have an open incident -> its row id
+        self.refresh_open()
+
+    def refresh_open(self):
+        """
+        Re-read the open incidents, needed when another process may have opened or closed some
+        """
+        with self._lock:
+            self._open = {server: row_id for row_id, server in self._db.execute(
+                "SELECT rowid, server FROM incidents WHERE end_ts IS NULL")}
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def record(self, server: str, success: bool, latency_ms: Optional[float] = None, ts: Optional[float] = None):
+        """
+        Buffer one check result. Nothing is written until flush() is called
+        :param server: the (normalized) server name
+        :param success: the check result
+        :param latency_ms: the check duration
+        :param ts: the epoch time of the check (default: now)
+        """
+        with self._lock:
+            self._buffer.append((int(time.time() if ts is None else ts), server, int(bool(success)), latency_ms))
+
+    def flush(self) -> int:
+        """
+        Insert all buffered results, update the rollups and incidents, all in one transaction
+        :return: the number of results written
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        rollups: Dict[Tuple[str, int, int], List[float]] = {}
+        for ts, server, success, latency in rows:
+            for period in self.periods:
+                agg = rollups.setdefault((server, period, ts - ts % period), [0, 0, 0.0, 0])
+                agg[0] += 1
+                agg[1] += success
+                if latency is not None:
+                    agg[2] += latency
+                    agg[3] += 1
+        with self._db:
+            self._db.executemany("INSERT INTO checks (ts, server, success, latency_ms) VALUES (?, ?, ?, ?)", rows)
+            self._db.executemany(
+                "INSERT INTO rollups (server, period, bucket, checks, up, latency_sum, latency_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (server, period, bucket) DO UPDATE SET "
+                "checks = checks + excluded.checks, up = up + excluded.up, "
+                "latency_sum = latency_sum + excluded.latency_sum, "
+                "latency_count = latency_count + excluded.latency_count",
+                [key + tuple(agg) for key, agg in rollups.items()])
+            for ts, server, success, _ in sorted(rows):
+                if not success and server not in self._open:
+                    self._open[server] = self._db.execute(
+                        "INSERT INTO incidents (server, start_ts) VALUES (?, ?)", (server, ts)).lastrowid
+                elif success and server in self._open:
+                    self._db.execute("UPDATE incidents SET end_ts = ? WHERE rowid = ?", (ts, self._open.pop(server)))
+        return len(rows)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Remove raw checks older than the retention period
+        :return: the number of rows removed
+        """
+        cutoff = int((time.time() if now is None else now) - self.retention_days * DAY)
+        with self._db:
+            return self._db.execute("DELETE FROM checks WHERE ts < ?", (cutoff,)).rowcount
+
+    def _totals(self, server: str, since: int, until: int) -> Tuple[int, int, float, int]:
+        """
+        Sum checks, up checks and latency over [since, until): whole days and hours from the rollups,
+        only the ragged edges from the raw checks
+        """
+        totals = [0, 0, 0.0, 0]
+
+        def add(row):
+            for i, value in enumerate(row):
+                totals[i] += value or 0
+
+        def raw(start, end):
+            if start < end:
+                add(self._db.execute(
+                    "SELECT COUNT(*), SUM(success), SUM(latency_ms), COUNT(latency_ms) FROM checks "
+                    "WHERE server = ? AND ts >= ? AND ts < ?", (server, start, end)).fetchone())
+
+        def rolled(start, end, period):
+            if start < end:
+                add(self._db.execute(
+                    "SELECT SUM(checks), SUM(up), SUM(latency_sum), SUM(latency_count) FROM rollups "
+                    "WHERE server = ? AND period = ? AND bucket >= ? AND bucket < ?",
+                    (server, period, start, end)).fetchone())
+
+        hour_start, hour_end = -(-since // HOUR) * HOUR, until // HOUR * HOUR
+        if hour_start >= hour_end:
+            raw(since, until)
+            return totals[0], totals[1], totals[2], totals[3]
+        day_start, day_end = -(-hour_start // DAY) * DAY, hour_end // DAY * DAY
+        if day_start < day_end:
+            rolled(day_start, day_end, DAY)
+            rolled(hour_start, day_start, HOUR)
+            rolled(day_end, hour_end, HOUR)
+        else:
+            rolled(hour_start, hour_end, HOUR)
+        raw(since, hour_start)
+        raw(hour_end, until)
+        return totals[0], totals[1], totals[2], totals[3]
+
+    @staticmethod
+    def _range(since: float, until: Optional[float]) -> Tuple[int, int]:
+        return int(since), int(time.time() + 1 if until is None else until)
+
+    def uptime(self, server: str, since: float, until: Optional[float] = None) -> Optional[float]:
+        """
+        :param server: the (normalized) server name
+        :param since: epoch start of the range
+        :param until: epoch end of the range (default: now)
+        :return: the fraction of successful checks (0-1), None if there were no checks
+        """
+        self.flush()
+        checks, up, _, _ = self._totals(server, *self._range(since, until))
+        return up / checks if checks else None
+
+    def average_latency(self, server: str, since: float, until: Optional[float] = None) -> Optional[float]:
+        """
+        :return: the mean check duration in milliseconds over the range, None if nothing was recorded
+        """
+        self.flush()
+        _, _, latency_sum, latency_count = self._totals(server, *self._range(since, until))
+        return latency_sum / latency_count if latency_count else None
+
+    def incidents(self, server: str, since: float, until: Optional[float] = None) -> List[Tuple[int, Optional[int]]]:
+        """
+        :return: (start, end) epoch times of the outages that started in the range, end is None while ongoing
+        """
+        self.flush()
+        return self._db.execute(
+            "SELECT start_ts, end_ts FROM incidents WHERE server = ? AND start_ts >= ? AND start_ts < ? "
+            "ORDER BY start_ts", (server,) + self._range(since, until)).fetchall()
+
+    def mttr(self, server: str, since: float, until: Optional[float] = None) -> Optional[float]:
+        """
+        :return: the mean time to recovery in seconds of the outages that started in the range and have ended,
+            None if there were none
+        """
+        durations = [end - start for start, end in self.incidents(server, since, until) if end is not None]
+        return sum(durations) / len(durations) if durations else None
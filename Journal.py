@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+from ConfQuick import ConfQuick
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+class Journal:
+    """
+    Collects alert state changes for all servers during a cycle and writes them to the config file in one go.
+    Writes are serialized through a lock file so several worker processes can share the journal. take() and write()
+    split a flush so the slow part can run in another thread while more changes are recorded.
+    The workers of a sharded run keep their entries as rows of a SQLite store instead, a write updates only the rows of
+    the servers that changed and does not wait for the other workers to rewrite the file
+    """
+    fields = ("alert", "last_alert", "alert_start", "alert_count", "fail_streak", "recovery_count")
+    schema = """
+        CREATE TABLE IF NOT EXISTS journal (name TEXT PRIMARY KEY, state TEXT NOT NULL, seq INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS journal_seq ON journal (seq);
+    """
+
+    def __init__(self, conf: ConfQuick, root: str = "journal", store: Optional[str] = None):
+        """
+        :param conf: the loaded configuration that holds the journal section
+        :param root: the key path of the journal section
+        :param store: the SQLite database to keep the entries in, entries of the config file are read for servers
+            that have no row yet (default: the config file)
+        """
+        self.conf = conf
+        self.root = root
+        self._saved: Dict[str, dict] = {}
+        self._stored: Dict[str, dict] = {}  # the rows of the store, they take precedence over the file
+        self._seq = 0  # the highest write sequence number read from the store
+        self._pending: Dict[str, dict] = {}
+        self._writing: Dict[str, dict] = {}  # taken from _pending, being written
+        self._lock = threading.RLock()  # the config is reloaded and written by one thread at a time
+        self._handover = threading.Lock()  # guards moving entries between _pending and _writing
+        self._nested = False  # entries of dotted names were saved nested by an older version, flush() flattens them
+        self.generation = 0  # counts the reloads that changed more than the journal (another worker's flush does not)
+        self._mtime = self._file_mtime()
+        self._digest = self._settings_digest()
+        self._load_saved()
+        self._db: Optional[sqlite3.Connection] = None
+        if store:
+            self._db = self._connect(store)
+            self._load_stored()
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.conf.conf_file)
+        except OSError:
+            return None
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.conf.conf_file}.lock", "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _connect(self, store: str) -> sqlite3.Connection:
+        # shares the file with the shard store, a rollback journal like the store's own connection
+        db = sqlite3.connect(store, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=DELETE")
+        db.executescript(self.schema)
+        return db
+
+    def _load_stored(self) -> bool:
+        """
+        Read the rows written since the last call
+        :return: True if there were any
+        """
+        rows = self._db.execute("SELECT name, state, seq FROM journal WHERE seq > ?", (self._seq,)).fetchall()
+        for name, state, seq in rows:
+            self._stored[name] = self._row_entry(state)
+            self._seq = max(self._seq, seq)
+        return bool(rows)
+
+    def _row_entry(self, state: str) -> dict:
+        entry = json.loads(state)
+        return {f: entry.get(f) for f in self.fields}
+
+    def adopt(self, store: str) -> int:
+        """
+        Move the entries the workers of an earlier sharded run kept in a store into the config file
+        :param store: the SQLite database
+        :return: the number of entries moved
+        """
+        if self._db is not None or not os.path.exists(store):
+            return 0
+        db = self._connect(store)
+        try:
+            rows = db.execute("SELECT name, state, seq FROM journal").fetchall()
+            if not rows:
+                return 0
+            with self._handover:
+                for name, state, _ in rows:
+                    self._pending[name] = self._row_entry(state)
+            self.flush()
+            db.execute("DELETE FROM journal WHERE seq <= ?", (max(seq for _, _, seq in rows),))
+            return len(rows)
+        finally:
+            db.close()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _settings_digest(self) -> str:
+        # everything but the journal section, workers sharing the file change the journal all the time
+        settings = {k: v for k, v in self.conf.conf.items() if k != self.root}
+        return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+    def refresh(self) -> bool:
+        """
+        Pick up entries written by other processes since the file was loaded (recorded changes are kept)
+        :return: True if the file or the store had changed
+        """
+        with self._lock:
+            stored = self._db is not None and self._load_stored()
+            if self._file_mtime() == self._mtime:
+                return stored
+            self.conf.reload()
+            self._load_saved()
+            self._mtime = self._file_mtime()
+            digest = self._settings_digest()
+            if digest != self._digest:
+                self._digest = digest
+                self.generation += 1
+            return True
+
+    def _entries(self, section: dict, prefix: str = "") -> Iterator[Tuple[str, dict]]:
+        # a dict without journal fields holds the entries of dotted names (db.example.com as db: example: com:)
+        for key, entry in section.items():
+            if type(entry) is not dict:
+                continue
+            if any(f in entry for f in self.fields):
+                yield f"{prefix}{key}", entry
+            elif entry:
+                self._nested = True
+                yield from self._entries(entry, f"{prefix}{key}.")
+
+    def _load_saved(self):
+        entries = self.conf.get(self.root, {}) or {}
+        if type(entries) is not dict:
+            entries = {}  # not a journal section (e.g. a list written by an older version), it is replaced on flush
+        self._nested = False
+        self._saved = {name: {f: entry.get(f) for f in self.fields} for name, entry in self._entries(entries)}
+
+    def get(self, name: str) -> dict:
+        """
+        Get the most recent state recorded for a server
+        :param name: the normalized server name
+        :return: a dictionary of the journal fields (empty if the server has no journal entry)
+        """
+        return dict(self._pending.get(name) or self._writing.get(name) or self._stored.get(name) or
+                    self._saved.get(name) or {})
+
+    def record(self, name: str, **state):
+        """
+        Record the state of a server. Nothing is written until flush() is called
+        :param name: the normalized server name
+        :param state: values for the journal fields
+        """
+        entry = {f: state.get(f) for f in self.fields}
+        if entry == (self._stored.get(name) or self._saved.get(name)):
+            self._pending.pop(name, None)
+        else:
+            self._pending[name] = entry
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    def flush(self) -> bool:
+        """
+        Write all recorded changes with a single atomic save of the configuration file (or one store transaction)
+        :return: True if the file was written, False if there was nothing to write
+        """
+        return self.write(self.take())
+
+    def take(self) -> Dict[str, dict]:
+        """
+        Hand the recorded changes over to write(), changes recorded from now on wait for the next write
+        :return: the entries to write
+        """
+        with self._handover:
+            entries, self._pending = self._pending, {}
+            self._writing = {**self._writing, **entries}
+        return entries
+
+    def write(self, entries: Dict[str, dict]) -> bool:
+        """
+        Write entries returned by take() with a single atomic save of the configuration file (or one store
+        transaction). Thread safe, the entries are recorded again if they cannot be written
+        :return: True if the entries were written, False if there was nothing to write
+        """
+        if not entries:
+            return False
+        try:
+            with self._lock:
+                if self._db is not None:
+                    self._write_store(entries)
+                else:
+                    self._write_file(entries)
+        except BaseException:
+            with self._handover:
+                for name, entry in entries.items():
+                    self._pending.setdefault(name, entry)  # unless a newer state was recorded meanwhile
+            raise
+        finally:
+            with self._handover:
+                self._writing = {k: v for k, v in self._writing.items() if k not in entries}
+        return True
+
+    def _write_file(self, entries: Dict[str, dict]):
+        with self._locked():
+            # the file was edited (or written by another worker) since it was loaded, do not overwrite those edits
+            self.refresh()
+            if type(self.conf.get(self.root)) is not dict or self._nested:
+                self.conf.set(self.root, {name: dict(entry) for name, entry in self._saved.items()}, False)
+                self._nested = False
+            for name, entry in entries.items():
+                key = name.replace('.', '\\.')  # one entry per name, a dot does not start a nested key
+                for field, value in entry.items():
+                    self.conf.set(f"{self.root}.{key}.{field}", value, False)
+            self.conf.save()
+            self._saved.update(entries)
+            self._mtime = self._file_mtime()
+
+    def _write_store(self, entries: Dict[str, dict]):
+        # every row of a write gets the next sequence number, refresh() reads the rows above the last one it saw
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM journal").fetchone()[0]
+            self._db.executemany("INSERT INTO journal (name, state, seq) VALUES (?, ?, ?) ON CONFLICT (name) "
+                                 "DO UPDATE SET state = excluded.state, seq = excluded.seq",
+                                 [(name, json.dumps(entry), seq) for name, entry in entries.items()])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._stored.update(entries)
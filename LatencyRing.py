@@ -0,0 +1,94 @@
+import math
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+
+class LatencyRing:
+    """
+    Fixed size history of probe phase timings (milliseconds) backed by float32 arrays, one per phase.
+    The arrays grow with the samples up to size * phases * 4 bytes, a one-shot run holds a single sample.
+    Missing values are stored as NaN
+    """
+    phases = ("dns", "connect", "tls", "response", "total")
+
+    def __init__(self, size: int = 240, phases: Optional[Sequence[str]] = None):
+        """
+        :param size: the number of checks to keep
+        :param phases: the phase names (default: dns, connect, tls, response, total)
+        """
+        self.size = max(1, int(size))
+        if phases is not None:
+            self.phases = tuple(phases)
+        self._data: Dict[str, array] = {p: array('f') for p in self.phases}
+        self._next = 0
+        self.count = 0  # number of samples stored, at most size
+
+    def __len__(self):
+        return self.count
+
+    def add(self, **timings: Optional[float]):
+        """
+        Store one check. Phases that are not given (or None) are stored as missing
+        """
+        full = self.count == self.size
+        for phase, data in self._data.items():
+            value = timings.get(phase)
+            value = math.nan if value is None else value
+            if full:
+                data[self._next] = value
+            else:
+                data.append(value)
+        self._next = (self._next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self, phase: str, last: Optional[int] = None) -> List[float]:
+        """
+        :param phase: the phase name
+        :param last: only the most recent samples (default: all)
+        :return: the stored values in the order they were added, missing values skipped
+        """
+        data = self._data[phase]
+        count = self.count if last is None else min(max(int(last), 0), self.count)
+        start = (self._next - count) % self.size
+        if start + count <= self.size:
+            window = data[start:start + count]
+        else:
+            window = data[start:] + data[:(start + count) % self.size]
+        return [v for v in window if not math.isnan(v)]
+
+    @staticmethod
+    def _percentile(ordered: List[float], pct: float) -> Optional[float]:
+        if not ordered:
+            return None
+        rank = (len(ordered) - 1) * pct / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+    def percentile(self, phase: str, pct: float) -> Optional[float]:
+        """
+        :return: the percentile (0-100) of the phase, None if there are no samples
+        """
+        return self._percentile(sorted(self.values(phase)), pct)
+
+    def moving_average(self, phase: str, window: int) -> Optional[float]:
+        """
+        :return: the mean of the most recent samples of the phase, None if there are no samples
+        """
+        values = self.values(phase, window)
+        return sum(values) / len(values) if values else None
+
+    def summary(self, phase: str = "total", window: int = 10) -> Dict[str, Optional[float]]:
+        """
+        :return: p50, p95, p99, the overall mean and the moving average over the last `window` checks
+        """
+        values = self.values(phase)
+        ordered = sorted(values)
+        return {
+            "p50": self._percentile(ordered, 50),
+            "p95": self._percentile(ordered, 95),
+            "p99": self._percentile(ordered, 99),
+            "mean": sum(values) / len(values) if values else None,
+            "moving_average": self.moving_average(phase, window),
+            "samples": len(values),
+        }
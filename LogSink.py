@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+
+class LogSink:
+    """
+    Buffers log lines and appends them to their files in batches, rotating files by size and/or time.
+    Optionally writes one combined JSON lines file instead of one file per server
+    """
+
+    def __init__(self, directory: str, combined: bool = False, combined_name: str = "sermon",
+                 max_bytes: int = 10485760, backups: int = 5, rotate_interval: float = 0,
+                 flush_interval: float = 5, buffer_size: int = 65536):
+        """
+        :param directory: the folder the log files are written to
+        :param combined: write every line to {combined_name}.jsonl as a JSON object instead of {name}.log
+        :param combined_name: the file name (without extension) of the combined log
+        :param max_bytes: rotate a file once it grows beyond this size (0 disables size rotation)
+        :param backups: the number of rotated files to keep ({name}.log.1 is the newest)
+        :param rotate_interval: rotate a file when its last write was in an earlier period of this many seconds
+            (86400 = daily, 0 disables time rotation)
+        :param flush_interval: seconds buffered lines may wait before they are written
+        :param buffer_size: bytes buffered in total before everything is written
+        """
+        self.directory = directory
+        self.combined = combined
+        self.combined_name = combined_name
+        self.max_bytes = int(max_bytes)
+        self.backups = int(backups)
+        self.rotate_interval = float(rotate_interval)
+        self.flush_interval = float(flush_interval)
+        self.buffer_size = int(buffer_size)
+        self._buffers: Dict[str, List[str]] = {}
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+
+    def path(self, name: str) -> str:
+        if self.combined:
+            return f"{self.directory}/{self.combined_name}.jsonl"
+        return f"{self.directory}/{name}.log"
+
+    def write(self, name: str, text: str, **fields):
+        """
+        Buffer a log line
+        :param name: the (normalized) server name
+        :param text: the log line
+        :param fields: extra values for the combined JSON log (ignored for per-server logs)
+        """
+        if self.combined:
+            record = {"time": datetime.now().isoformat(timespec="seconds"), "server": name, "text": text}
+            record.update(fields)
+            line = json.dumps(record, default=str)
+        else:
+            line = text
+        with self._lock:
+            self._buffers.setdefault(self.path(name), []).append(f"{line}\n")
+            self._buffered += len(line) + 1
+            if self._buffered >= self.buffer_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Write all buffered lines, one open/append per file
+        """
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            self._buffered = 0
+            self._last_flush = time.monotonic()
+            for path, lines in buffers.items():
+                data = "".join(lines)
+                self._rotate_if_needed(path, len(data.encode()))
+                with open(path, "a") as f:
+                    f.write(data)
+
+    def _rotate_if_needed(self, path: str, incoming: int):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if self.max_bytes and stat.st_size and stat.st_size + incoming > self.max_bytes:
+            self._rotate(path)
+        elif self.rotate_interval and int(stat.st_mtime // self.rotate_interval) < int(time.time() //
+                                                                                      self.rotate_interval):
+            self._rotate(path)
+
+    def _rotate(self, path: str):
+        if self.backups <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
@@ -0,0 +1,164 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms for the monitor itself, rendered in the Prometheus text format.
+    Optionally served over HTTP and optionally profiling whole cycles with cProfile
+    """
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+
+    def __init__(self, prefix: str = "sermon"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}  # -> [bucket counts..., sum, count]
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._profiler = None
+
+    @staticmethod
+    def _labels(labels: Optional[dict]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        if name not in self._help:
+            self._help[name] = (kind, help_text or name.replace('_', ' '))
+
+    def inc(self, name: str, value: float = 1, labels: Optional[dict] = None, help_text: str = ""):
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            key = (name, self._labels(labels))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Optional[dict] = None, help_text: str = ""):
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            self._gauges[(name, self._labels(labels))] = value
+
+    def observe(self, name: str, seconds: float, labels: Optional[dict] = None, help_text: str = ""):
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            key = (name, self._labels(labels))
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[dict] = None, help_text: str = ""):
+        """
+        Observe the duration of the with-block in the histogram `name` (seconds)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels, help_text)
+
+    @staticmethod
+    def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+        if not labels:
+            return ""
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+    def render(self) -> str:
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(self._help.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind == "histogram":
+                    for (n, labels), hist in sorted(self._histograms.items()):
+                        if n != name:
+                            continue
+                        for bound, count in zip(self.buckets, hist):
+                            le = self._format_labels(labels + (("le", str(bound)),))
+                            lines.append(f"{full}_bucket{le} {count}")
+                        lines.append(f"{full}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {hist[-1]}")
+                        lines.append(f"{full}_sum{self._format_labels(labels)} {hist[-2]}")
+                        lines.append(f"{full}_count{self._format_labels(labels)} {hist[-1]}")
+                else:
+                    values = self._counters if kind == "counter" else self._gauges
+                    for (n, labels), value in sorted(values.items()):
+                        if n == name:
+                            lines.append(f"{full}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serve /metrics from a background thread
+        :param port: the TCP port (0 picks a free port, see server_address)
+        :param host: the address to listen on (local only by default)
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.stop_serving()
+        self._server = ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="SerMon-Metrics", daemon=True).start()
+
+    @property
+    def server_address(self) -> Optional[Tuple[str, int]]:
+        return self._server.server_address if self._server is not None else None
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def profile_start(self):
+        """
+        Start profiling with cProfile (no-op if already running)
+        """
+        if self._profiler is None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def profile_dump(self, path: str, stop: bool = False):
+        """
+        Write the profile collected so far (load with pstats or snakeviz)
+        :param path: the output file
+        :param stop: stop profiling afterwards
+        """
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        self._profiler.dump_stats(path)
+        if stop:
+            self._profiler = None
+        else:
+            self._profiler.enable()
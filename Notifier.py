@@ -0,0 +1,186 @@
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText as Message
+from typing import Callable, Dict, List, Optional, Tuple
+from Metrics import Metrics
+
+
+class Notifier:
+    """
+    Delivers notifications from a background thread. One authenticated SMTP connection is kept per smtp server and
+    messages for the same recipients that arrive within the digest window are sent as a single email
+    """
+
+    def __init__(self, digest_window: float = 10.0, idle_timeout: float = 60.0, timeout: float = 30.0,
+                 metrics: Optional[Metrics] = None):
+        """
+        :param digest_window: seconds to wait for more messages to the same recipients before sending
+        :param idle_timeout: seconds before an unused SMTP connection is closed
+        :param timeout: seconds an SMTP server may take to connect, greet or answer a command
+        :param metrics: records delivery times and failures
+        """
+        self.metrics = metrics
+        self.digest_window = max(0.0, float(digest_window))
+        self.idle_timeout = float(idle_timeout)
+        self.timeout = float(timeout)
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: Dict[tuple, dict] = {}  # digest key -> {'due', 'smtp', 'recipients', 'messages'}
+        self._connections: Dict[str, Tuple[smtplib.SMTP, float]] = {}  # smtp key -> (connection, last used)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="SerMon-Notifier", daemon=True)
+                self._thread.start()
+
+    def send(self, smtp: dict, recipients: List[str], subject: str, message: str,
+             on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        Queue a notification, returns immediately
+        :param smtp: the smtp server settings (host, port, username, password, secure_mode, email)
+        :param recipients: the email addresses to send to
+        :param subject: the email subject
+        :param message: the email body
+        :param on_error: called from the worker thread with the exception if the message could not be delivered
+        """
+        self._ensure_worker()
+        self._queue.put((smtp, list(recipients), subject, message, on_error))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send everything that is queued or waiting for its digest window right away
+        :param timeout: seconds to wait for the delivery
+        :return: True if everything was handed to the smtp servers before the timeout
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Flush, then stop the worker thread and close the SMTP connections
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    @staticmethod
+    def _smtp_key(smtp: dict) -> str:
+        return smtp.get('name') or f"{smtp.get('host')}:{smtp.get('port')}:{smtp.get('username')}"
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            due = min([p['due'] for p in self._pending.values()] +
+                      [used + self.idle_timeout for _, used in self._connections.values()], default=None)
+            try:
+                item = self._queue.get(timeout=None if due is None else max(due - now, 0))
+            except queue.Empty:
+                item = False
+            if item is None:  # close
+                self._deliver(force=True)
+                self._disconnect_all()
+                return
+            elif isinstance(item, threading.Event):  # flush
+                self._deliver(force=True)
+                item.set()
+            elif item is not False:
+                self._add(*item)
+            self._deliver()
+            self._disconnect_idle()
+
+    def _add(self, smtp: dict, recipients: List[str], subject: str, message: str, on_error):
+        key = (self._smtp_key(smtp), smtp.get('email'), tuple(sorted(recipients)))
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {'due': time.monotonic() + self.digest_window, 'smtp': smtp,
+                                            'recipients': recipients, 'messages': []}
+        pending['messages'].append((subject, message, on_error))
+
+    def _deliver(self, force=False):
+        now = time.monotonic()
+        for key in [k for k, p in self._pending.items() if force or p['due'] <= now]:
+            pending = self._pending.pop(key)
+            messages = pending['messages']
+            if len(messages) == 1:
+                subject, body = messages[0][0], messages[0][1]
+            else:
+                subject = f"SerMon: {len(messages)} notifications - {messages[0][0]}"
+                body = "\n\n".join(f"{s}\n{m}" for s, m, _ in messages)
+            start = time.perf_counter()
+            try:
+                self._sendmail(pending['smtp'], pending['recipients'], subject, body)
+                if self.metrics is not None:
+                    self.metrics.observe("email_send_seconds", time.perf_counter() - start,
+                                         help_text="Time to deliver one (digest) email")
+                    self.metrics.inc("emails_sent_total", help_text="Emails delivered")
+            except Exception as ex:
+                if self.metrics is not None:
+                    self.metrics.inc("emails_failed_total", help_text="Emails that could not be delivered")
+                for _, _, on_error in messages:
+                    if on_error is not None:
+                        try:
+                            on_error(ex)
+                        except Exception:
+                            pass
+
+    def _sendmail(self, smtp: dict, recipients: List[str], subject: str, body: str):
+        from_email = smtp.get("email")
+        msg = Message(body, "plain")
+        msg["Subject"] = subject
+        msg["From"] = from_email
+        key = self._smtp_key(smtp)
+        for attempt in range(2):
+            cn = self._connect(smtp, key)
+            try:
+                cn.sendmail(from_email, recipients, msg.as_string())
+                self._connections[key] = (cn, time.monotonic())
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # the relay dropped the pooled connection, reconnect once
+                self._drop(key)
+                if attempt:
+                    raise
+
+    def _connect(self, smtp: dict, key: str) -> smtplib.SMTP:
+        if key in self._connections:
+            return self._connections[key][0]
+        secure_mode = smtp.get("secure_mode", 'plain')
+        smtp_class = smtplib.SMTP_SSL if secure_mode == 'ssl' else smtplib.SMTP
+        cn = smtp_class(smtp.get("host"), smtp.get("port"), timeout=self.timeout)
+        try:
+            cn.ehlo()
+            if secure_mode == 'tls':
+                cn.starttls()
+                cn.ehlo()
+            if smtp.get("username"):
+                cn.login(smtp.get("username"), smtp.get("password"))
+        except Exception:
+            cn.close()
+            raise
+        self._connections[key] = (cn, time.monotonic())
+        return cn
+
+    def _drop(self, key: str):
+        cn, _ = self._connections.pop(key, (None, None))
+        if cn is not None:
+            try:
+                cn.quit()
+            except Exception:
+                cn.close()
+
+    def _disconnect_idle(self):
+        now = time.monotonic()
+        for key in [k for k, (_, used) in self._connections.items() if now - used >= self.idle_timeout]:
+            self._drop(key)
+
+    def _disconnect_all(self):
+        for key in list(self._connections):
+            self._drop(key)
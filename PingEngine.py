@@ -0,0 +1,189 @@
+import asyncio
+import os
+import select
+import socket
+import struct
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+
+class PingEngine:
+    """
+    Sends ICMP echo requests to any number of hosts from a single socket and matches the replies by id/sequence.
+    Unprivileged ICMP datagram sockets are used when the OS allows them (linux: net.ipv4.ping_group_range),
+    otherwise a raw socket is opened (requires root / CAP_NET_RAW). IPv4 only.
+    """
+    payload = b"SerMon-ping-engine"
+    receive_buffer = 1 << 20  # replies to a large sweep arrive in a burst
+    _shared: Optional['PingEngine'] = None
+    _unavailable = False
+
+    def __init__(self):
+        self.sock, self.raw = self._open_socket()
+        self.sock.setblocking(False)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        except OSError:
+            pass
+        self.ident = os.getpid() & 0xffff
+        self._seq = 0
+        self._waiting: Dict[int, Tuple[str, float, Optional[asyncio.Future]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def shared(cls) -> Optional['PingEngine']:
+        """
+        Get the engine shared by all servers
+        :return: the engine, or None if this process is not allowed to open an ICMP socket
+        """
+        if cls._shared is None and not cls._unavailable:
+            try:
+                cls._shared = cls()
+            except OSError:
+                cls._unavailable = True
+        return cls._shared
+
+    @staticmethod
+    def _open_socket() -> Tuple[socket.socket, bool]:
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+        except OSError:
+            return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+    def close(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        if PingEngine._shared is self:
+            PingEngine._shared = None
+
+    @staticmethod
+    def checksum(data: bytes) -> int:
+        if len(data) % 2:
+            data += b"\0"
+        total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+        total = (total >> 16) + (total & 0xffff)
+        total += total >> 16
+        return ~total & 0xffff
+
+    def _next_seq(self) -> int:
+        # skip sequence numbers that are still waiting for a reply
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xffff
+            if self._seq not in self._waiting:
+                return self._seq
+        raise OverflowError("too many echo requests in flight")
+
+    def _send(self, address: str, future: Optional[asyncio.Future] = None) -> int:
+        seq = self._next_seq()
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, self.checksum(header + self.payload), self.ident, seq)
+        self._waiting[seq] = (address, time.perf_counter(), future)
+        try:
+            self.sock.sendto(header + self.payload, (address, 0))
+        except OSError:
+            self._waiting.pop(seq, None)
+            raise
+        return seq
+
+    def _read_replies(self) -> Dict[int, float]:
+        """
+        Drain the socket without blocking
+        :return: the sequence numbers that received a reply and their round trip time in milliseconds
+        """
+        received = {}
+        while True:
+            try:
+                data, (address, _) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return received
+            except OSError:
+                # an ICMP error queued on the socket, the matching request simply times out
+                continue
+            now = time.perf_counter()
+            if data and data[0] >> 4 == 4:  # raw sockets (and some datagram sockets) include the IP header
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+            # datagram sockets get their id rewritten by the kernel and only receive their own replies
+            if icmp_type != ICMP_ECHO_REPLY or (self.raw and ident != self.ident):
+                continue
+            waiting = self._waiting.get(seq)
+            if waiting is None or waiting[0] != address:
+                continue
+            self._waiting.pop(seq)
+            received[seq] = (now - waiting[1]) * 1000
+            future = waiting[2]
+            if future is not None and not future.done():
+                future.set_result(received[seq])
+
+    def sweep(self, hosts: Iterable[str], timeout: float) -> Dict[str, Optional[float]]:
+        """
+        Ping many hosts at once, blocking until every host replied or the timeout expired
+        :param hosts: host names or IPv4 addresses
+        :param timeout: seconds to wait for the replies
+        :return: the round trip time in milliseconds for each host, None if it did not reply (or did not resolve)
+        """
+        results: Dict[str, Optional[float]] = {}
+        pending: Dict[int, str] = {}
+
+        def collect():
+            for r_seq, rtt in self._read_replies().items():
+                if r_seq in pending:
+                    results[pending.pop(r_seq)] = rtt
+
+        try:
+            for host in hosts:
+                results[host] = None
+                try:
+                    pending[self._send(socket.gethostbyname(host))] = host
+                except OSError:
+                    pass
+                collect()  # keep draining while sending so early replies do not overflow the socket buffer
+            deadline = time.perf_counter() + timeout
+            while pending:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                if select.select([self.sock], [], [], remaining)[0]:
+                    collect()
+        finally:
+            for seq in pending:
+                self._waiting.pop(seq, None)
+        return results
+
+    def ping(self, host: str, timeout: float) -> Optional[float]:
+        """
+        Ping a single host
+        :return: the round trip time in milliseconds, None if the host did not reply in time
+        """
+        return self.sweep([host], timeout)[host]
+
+    def _attach(self, loop: asyncio.AbstractEventLoop):
+        if self._loop is loop:
+            return
+        # futures from a previous (finished) event loop can never complete
+        self._waiting = {seq: w for seq, w in self._waiting.items() if w[2] is None}
+        self._loop = loop
+        loop.add_reader(self.sock.fileno(), self._read_replies)
+
+    async def async_ping(self, host: str, timeout: float) -> Optional[float]:
+        """
+        Ping a single host without blocking the event loop. Concurrent calls share the socket
+        :return: the round trip time in milliseconds, None if the host did not reply in time
+        """
+        loop = asyncio.get_running_loop()
+        self._attach(loop)
+        infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_RAW)
+        future = loop.create_future()
+        seq = self._send(infos[0][4][0], future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiting.pop(seq, None)
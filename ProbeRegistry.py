@@ -0,0 +1,281 @@
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple, Type, Union
+from ConnectionPool import Connection
+
+
+class ProbeFailed(Exception):
+    """
+    The target accepted the connection but did not answer as expected
+    """
+    pass
+
+
+class Probe(ABC):
+    """
+    A protocol check on an open connection. Subclasses are registered under a conn_type, their constructor takes the
+    server's probe settings
+    """
+    tls = False  # the connection is wrapped in TLS before exchange()
+
+    @abstractmethod
+    async def exchange(self, conn: Connection, host: str, port: int) -> bool:
+        """
+        Talk to the target, raise ProbeFailed if it does not answer as expected
+        :param conn: the connection, new or reused from an earlier check
+        :param host: the configured host name
+        :param port: the port
+        :return: True if the connection is left in a state the next check can reuse
+        """
+
+    def settings(self) -> dict:
+        """
+        :return: the settings that make the result of this probe differ from another one on the same target
+        """
+        return {k: v for k, v in vars(self).items() if not k.startswith('_')}
+
+
+class HttpProbe(Probe):
+    """
+    An HTTP/1.1 request that checks the status code and optionally the body. The connection is kept alive for the next
+    check unless the server closes it
+    """
+    max_body = 1048576  # bytes of the body read at most, a longer body closes the connection
+
+    def __init__(self, path: str = "/", method: str = "HEAD", expect_status: Union[int, str, list] = "200-399",
+                 expect_body: str = "", headers: Optional[dict] = None):
+        """
+        :param path: the request path
+        :param method: HEAD or GET
+        :param expect_status: the accepted status codes, e.g. 200, "200-399" or "200,301-302"
+        :param expect_body: a regular expression the body has to match (HEAD becomes GET)
+        :param headers: extra request headers
+        """
+        self.path = path if str(path).startswith("/") else f"/{path}"
+        self.method = "GET" if expect_body else str(method).upper()
+        self.expect_status = self._status_ranges(expect_status)
+        self.expect_body = expect_body
+        self.headers = dict(headers or {})
+        self._expect_body = re.compile(expect_body) if expect_body else None
+
+    @staticmethod
+    def _status_ranges(expect: Union[int, str, list]) -> Tuple[Tuple[int, int], ...]:
+        parts = expect if type(expect) is list else str(expect).split(',')
+        ranges = []
+        for part in parts:
+            low, _, high = str(part).strip().partition('-')
+            ranges.append((int(low), int(high or low)))
+        return tuple(ranges)
+
+    def _host_header(self, host: str, port: int) -> str:
+        name = f"[{host}]" if ':' in host else host
+        return name if int(port) == (443 if self.tls else 80) else f"{name}:{port}"
+
+    @staticmethod
+    async def _headers(conn: Connection) -> Dict[str, str]:
+        headers = {}
+        for _ in range(100):
+            line = (await conn.readline()).decode("latin-1").strip()
+            if not line:
+                return headers
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            headers[name] = f"{headers[name]}, {value.strip()}" if name in headers else value.strip()
+        raise ProbeFailed("too many response headers")
+
+    async def _body(self, conn: Connection, status: int, headers: Dict[str, str]) -> Tuple[bytes, bool]:
+        """
+        :return: (tuple) the body (up to max_body), True if it was read completely
+        """
+        if self.method == "HEAD" or status in (204, 304):
+            return b"", True
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = bytearray()
+            while len(body) <= self.max_body:
+                size = int((await conn.readline()).split(b';', 1)[0].strip() or b"0", 16)
+                if not size:
+                    while (await conn.readline()).strip():
+                        pass  # trailers
+                    return bytes(body), True
+                body += await conn.readexactly(size)
+                await conn.readline()
+            return bytes(body[:self.max_body]), False
+        if "content-length" in headers:
+            length = int(headers["content-length"].split(',')[0])
+            return await conn.readexactly(min(length, self.max_body)), length <= self.max_body
+        body = bytearray()  # until the server closes the connection
+        while len(body) < self.max_body:
+            data = await conn.read_some()
+            if not data:
+                break
+            body += data
+        return bytes(body[:self.max_body]), False
+
+    async def exchange(self, conn: Connection, host: str, port: int) -> bool:
+        request = [f"{self.method} {self.path} HTTP/1.1", f"Host: {self._host_header(host, port)}",
+                   "User-Agent: SerMon", "Accept: */*", "Connection: keep-alive"]
+        request += [f"{name}: {value}" for name, value in self.headers.items()]
+        await conn.write(("\r\n".join(request) + "\r\n\r\n").encode())
+        while True:
+            line = (await conn.readline()).decode("latin-1").strip()
+            parts = line.split(' ', 2)
+            if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+                raise ProbeFailed(f"not an HTTP response: {line[:80]!r}")
+            version, status, reason = parts[0], int(parts[1]), parts[2] if len(parts) > 2 else ""
+            headers = await self._headers(conn)
+            if not 100 <= status < 200 or status == 101:
+                break  # informational responses come before the real one
+        body, complete = await self._body(conn, status, headers)
+        if not any(low <= status <= high for low, high in self.expect_status):
+            raise ProbeFailed(f"HTTP {status} {reason}".strip())
+        if self._expect_body is not None and not self._expect_body.search(body.decode(errors="replace")):
+            raise ProbeFailed(f"HTTP {status} body does not match {self.expect_body!r}")
+        connection = headers.get("connection", "").lower()
+        keep_alive = "keep-alive" in connection if version == "HTTP/1.0" else "close" not in connection
+        return keep_alive and complete and status != 101
+
+
+class HttpsProbe(HttpProbe):
+    tls = True
+
+
+class SmtpProbe(Probe):
+    """
+    Reads the SMTP greeting and expects a 220 reply, then says QUIT
+    """
+
+    def __init__(self, expect: str = ""):
+        """
+        :param expect: a regular expression the greeting text has to match
+        """
+        self.expect = expect
+        self._expect = re.compile(expect) if expect else None
+
+    @staticmethod
+    async def _reply(conn: Connection) -> Tuple[int, str]:
+        lines = []
+        for _ in range(100):
+            line = (await conn.readline()).decode(errors="replace").rstrip("\r\n")
+            if not line[:3].isdigit():
+                raise ProbeFailed(f"not an SMTP reply: {line[:80]!r}")
+            lines.append(line[4:])
+            if line[3:4] != '-':
+                return int(line[:3]), "\n".join(lines)
+        raise ProbeFailed("SMTP reply too long")
+
+    async def exchange(self, conn: Connection, host: str, port: int) -> bool:
+        code, text = await self._reply(conn)
+        if code != 220:
+            raise ProbeFailed(f"SMTP greeting {code} {text}")
+        if self._expect is not None and not self._expect.search(text):
+            raise ProbeFailed(f"SMTP greeting does not match {self.expect!r}: {text[:80]!r}")
+        try:
+            await conn.write(b"QUIT\r\n")
+        except ConnectionError:
+            pass
+        return False
+
+
+class SmtpsProbe(SmtpProbe):
+    tls = True
+
+
+class MysqlProbe(Probe):
+    """
+    Reads the MySQL/MariaDB handshake. An error instead (too many connections, host blocked) fails the check
+    """
+
+    def __init__(self, expect_version: str = ""):
+        """
+        :param expect_version: a regular expression the server version has to match
+        """
+        self.expect_version = expect_version
+        self._expect_version = re.compile(expect_version) if expect_version else None
+
+    async def exchange(self, conn: Connection, host: str, port: int) -> bool:
+        header = await conn.readexactly(4)
+        length = int.from_bytes(header[:3], "little")
+        if not 0 < length <= 65536:
+            raise ProbeFailed(f"not a MySQL handshake: packet of {length} bytes")
+        payload = await conn.readexactly(length)
+        if payload[0] == 0xff:
+            code = int.from_bytes(payload[1:3], "little")
+            raise ProbeFailed(f"MySQL error {code}: {payload[3:].decode(errors='replace')}")
+        if payload[0] != 10:
+            raise ProbeFailed(f"unsupported MySQL protocol version {payload[0]}")
+        version = payload[1:].split(b"\0", 1)[0].decode(errors="replace")
+        if self._expect_version is not None and not self._expect_version.search(version):
+            raise ProbeFailed(f"MySQL version {version} does not match {self.expect_version!r}")
+        return False
+
+
+class ExpectProbe(Probe):
+    """
+    Sends a string and waits for a reply that matches a regular expression, e.g. send "PING\\r\\n" and
+    expect "^\\+PONG" for redis. Without send the first thing the server says (its banner) is matched
+    """
+    max_reply = 65536  # bytes
+
+    def __init__(self, send: str = "", expect: str = "", tls: bool = False, keep_alive: bool = False,
+                 encoding: str = "utf-8"):
+        """
+        :param send: sent after connecting
+        :param expect: a regular expression the reply has to match (empty: nothing is read)
+        :param tls: wrap the connection in TLS
+        :param keep_alive: reuse the connection for the next check (the protocol must allow it)
+        :param encoding: of send and expect
+        """
+        self.send = send
+        self.expect = expect
+        self.tls = bool(tls)
+        self.keep_alive = bool(keep_alive)
+        self.encoding = encoding
+        self._send = send.encode(encoding)
+        self._expect = re.compile(expect.encode(encoding)) if expect else None
+
+    async def exchange(self, conn: Connection, host: str, port: int) -> bool:
+        if self._send:
+            await conn.write(self._send)
+        if self._expect is None:
+            return False  # a reply may still arrive, the connection cannot be reused
+        reply = bytearray()
+        while not self._expect.search(reply):
+            data = await conn.read_some()
+            if not data or len(reply) > self.max_reply:
+                raise ProbeFailed(f"reply does not match {self.expect!r}: {bytes(reply[:80])!r}")
+            reply += data
+        return self.keep_alive
+
+
+class ProbeRegistry:
+    """
+    The protocol probes by conn_type. plain, ssl and ping are built into SerMon, any other registered conn_type runs
+    its probe on a (possibly pooled) connection
+    """
+    probes: Dict[str, Type[Probe]] = {
+        "http": HttpProbe,
+        "https": HttpsProbe,
+        "smtp": SmtpProbe,
+        "smtps": SmtpsProbe,
+        "mysql": MysqlProbe,
+        "expect": ExpectProbe,
+    }
+
+    @classmethod
+    def register(cls, conn_type: str, probe: Type[Probe]):
+        """
+        Add or replace the probe for a conn_type
+        """
+        cls.probes[conn_type.lower()] = probe
+
+    @classmethod
+    def create(cls, conn_type: str, settings: Optional[dict] = None) -> Optional[Probe]:
+        """
+        :param conn_type: the server's conn_type
+        :param settings: the server's probe settings
+        :return: a probe, None if the conn_type has no registered probe
+        """
+        probe = cls.probes.get(conn_type)
+        if probe is None:
+            return None
+        return probe(**(settings if type(settings) is dict else {}))
@@ -0,0 +1,130 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from typing import Dict, Optional, Tuple
+
+
+class Resolver:
+    """
+    Caches host name lookups. getaddrinfo does not expose the record TTL, so answers are kept for a configured TTL,
+    failures for a shorter negative TTL. Entries close to expiry are refreshed in the background by async_resolve,
+    concurrent lookups of the same name share one query
+    """
+    refresh_ahead = 0.8  # fraction of the TTL after which a cache hit triggers a background refresh
+
+    def __init__(self, ttl: float = 300, negative_ttl: float = 30, timeout: float = 2.0):
+        """
+        :param ttl: seconds a successful lookup is cached
+        :param negative_ttl: seconds a failed lookup is cached
+        :param timeout: seconds async_resolve waits for a lookup that is not cached
+        """
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.timeout = float(timeout)
+        # (host, family) -> (address or None, error or None, resolved at, expires at)
+        self._cache: Dict[Tuple[str, int], Tuple[Optional[str], Optional[Exception], float, float]] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}  # (host, family) -> the query being made
+
+    @staticmethod
+    def is_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def _store(self, key: Tuple[str, int], address: Optional[str], error: Optional[Exception]):
+        now = time.monotonic()
+        if error is not None:
+            error = error.with_traceback(None)  # only the error code and message are kept
+        self._cache[key] = (address, error, now, now + (self.ttl if error is None else self.negative_ttl))
+
+    def _cached(self, key: Tuple[str, int]) -> Optional[Tuple[Optional[str], Optional[Exception], float, float]]:
+        entry = self._cache.get(key)
+        if entry is not None and entry[3] <= time.monotonic():
+            self._cache.pop(key, None)
+            return None
+        return entry
+
+    @staticmethod
+    def _answer(entry) -> str:
+        if entry[1] is not None:
+            # a new exception per lookup, raising the cached one would keep growing its traceback
+            raise socket.gaierror(*entry[1].args)
+        return entry[0]
+
+    def resolve(self, host: str, family: int = socket.AF_UNSPEC) -> str:
+        """
+        Resolve a host name to an address, blocking if it is not cached
+        :param host: the host name (addresses are returned as they are)
+        :param family: socket.AF_INET / AF_INET6 to limit the address family
+        :return: the address, raises socket.gaierror if the name does not resolve
+        """
+        if self.is_address(host):
+            return host
+        key = (host, family)
+        entry = self._cached(key)
+        if entry is None:
+            try:
+                infos = socket.getaddrinfo(host, None, family, socket.SOCK_STREAM)
+                self._store(key, infos[0][4][0], None)
+            except socket.gaierror as ex:
+                self._store(key, None, ex)
+            entry = self._cache[key]
+        return self._answer(entry)
+
+    async def _lookup(self, key: Tuple[str, int]):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(key[0], None, family=key[1], type=socket.SOCK_STREAM),
+                                           self.timeout)
+            self._store(key, infos[0][4][0], None)
+        except socket.gaierror as ex:
+            self._store(key, None, ex)
+
+    def _query(self, key: Tuple[str, int]) -> asyncio.Task:
+        """
+        The lookup in flight for a key, started if there is none
+        :param key: (host, family)
+        :return: the task, it stores the answer in the cache
+        """
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._lookup(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.get(key) is done and self._inflight.pop(key))
+            task.add_done_callback(self._ignore_error)
+        return task
+
+    @staticmethod
+    def _ignore_error(task: asyncio.Task):
+        if not task.cancelled():
+            task.exception()  # seen by the callers waiting for it, a failed refresh keeps the current answer
+
+    async def async_resolve(self, host: str, family: int = socket.AF_UNSPEC) -> str:
+        """
+        Resolve a host name without blocking the event loop
+        :param host: the host name (addresses are returned as they are)
+        :param family: socket.AF_INET / AF_INET6 to limit the address family
+        :return: the address, raises socket.gaierror if the name does not resolve or asyncio.TimeoutError
+        """
+        if self.is_address(host):
+            return host
+        key = (host, family)
+        entry = self._cached(key)
+        if entry is None:
+            # shielded, a caller that is cancelled does not cancel the query for the others
+            await asyncio.shield(self._query(key))
+            entry = self._cache[key]
+        elif entry[1] is None and key not in self._inflight and \
+                time.monotonic() - entry[2] >= (entry[3] - entry[2]) * self.refresh_ahead:
+            self._query(key)  # refresh in the background
+        return self._answer(entry)
+
+    def forget(self, host: Optional[str] = None):
+        """
+        Drop cached answers for a host, or for every host
+        """
+        for key in [k for k in self._cache if host is None or k[0] == host]:
+            self._cache.pop(key, None)
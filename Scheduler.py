@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+
+class Scheduler:
+    """
+    Priority queue of items that are due on their own interval. Intervals are jittered so items that share an
+    interval drift apart instead of firing together
+    """
+
+    def __init__(self, jitter: float = 0.1):
+        """
+        :param jitter: the fraction an interval may randomly grow or shrink by (0.1 = +/- 10%)
+        """
+        self.jitter = max(0.0, min(float(jitter), 1.0))
+        self._heap: List[list] = []
+        self._entries: Dict[int, list] = {}  # id(item) -> heap entry, used for lazy removal
+        self._counter = itertools.count()
+        self.lag = 0.0  # seconds the most overdue item of the last pop_due() was behind schedule
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return id(item) in self._entries
+
+    def _jittered(self, interval: float) -> float:
+        if not self.jitter:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, item: Any, interval: float, delay: Optional[float] = None, now: Optional[float] = None):
+        """
+        Schedule an item. Replaces the item if it is already scheduled
+        :param item: the item to schedule
+        :param interval: seconds between runs
+        :param delay: seconds until the first run (default: a random point within the first interval)
+        :param now: the current time.monotonic() value
+        """
+        self.remove(item)
+        now = time.monotonic() if now is None else now
+        interval = max(float(interval), 0.001)
+        due = now + (random.uniform(0, interval) if delay is None else max(float(delay), 0))
+        entry = [due, next(self._counter), item, interval, True]  # the last field is False while the item runs
+        self._entries[id(item)] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, item: Any):
+        """
+        Unschedule an item (no error if it is not scheduled)
+        """
+        entry = self._entries.pop(id(item), None)
+        if entry is not None:
+            entry[2] = None  # left in the heap and skipped when it comes up
+
+    def next_due(self) -> Optional[float]:
+        """
+        :return: the time.monotonic() value the next item is due at, None if nothing is scheduled
+        """
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Any]:
+        """
+        Take all items that are due. They stay registered but are not queued again until reschedule() is called
+        :param now: the current time.monotonic() value
+        :return: the due items, most overdue first
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        self.lag = 0.0
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                entry[4] = False
+                if not due:
+                    self.lag = now - entry[0]
+                due.append(entry[2])
+        return due
+
+    def reschedule(self, item: Any, now: Optional[float] = None, interval: Optional[float] = None):
+        """
+        Queue an item that was returned by pop_due() for its next run. The next run is based on the previous due
+        time to keep the cadence, unless the item fell a whole interval behind (then it is based on now)
+        :param item: the item to queue
+        :param now: the current time.monotonic() value
+        :param interval: use this interval for the next run only, based on now (default: the item's interval)
+        """
+        entry = self._entries.get(id(item))
+        if entry is None:
+            return
+        now = time.monotonic() if now is None else now
+        if interval is not None and interval != entry[3]:
+            due = now + self._jittered(interval)
+        else:
+            due = entry[0] + self._jittered(entry[3])
+            if due < now:
+                due = now + self._jittered(entry[3])
+        entry = [due, next(self._counter), item, entry[3], True]
+        self._entries[id(item)] = entry
+        heapq.heappush(self._heap, entry)
+
+    def update(self, item: Any, interval: float, now: Optional[float] = None):
+        """
+        Change the interval of a scheduled item (no error if it is not scheduled). A waiting item runs within one new
+        interval from now at the latest, an item taken by pop_due() uses the new interval from its next run on
+        :param item: the scheduled item
+        :param interval: the new seconds between runs
+        :param now: the current time.monotonic() value
+        """
+        entry = self._entries.get(id(item))
+        if entry is None:
+            return
+        now = time.monotonic() if now is None else now
+        entry[3] = interval = max(float(interval), 0.001)
+        if entry[4] and entry[0] > now + interval:
+            entry[2] = None
+            entry = [now + random.uniform(0, interval), next(self._counter), item, interval, True]
+            self._entries[id(item)] = entry
+            heapq.heappush(self._heap, entry)
@@ -1,16 +1,152 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import os
+import signal
 import socket
 import ssl
+import time
 from datetime import datetime
 import subprocess
 import platform
+from typing import Dict, List, Optional, Tuple
 from ConfQuick import ConfQuick, BASE_DIR
+from Journal import Journal
+from PingEngine import PingEngine
+from Scheduler import Scheduler
+from Notifier import Notifier
+from LogSink import LogSink
+from Resolver import Resolver
+from TlsClient import TlsClient, CertificateExpiring
+from LatencyRing import LatencyRing
+from History import History
+from Metrics import Metrics
+from Shard import Shard
+from AlertPolicy import AlertPolicy
+from AlertStore import AlertStore, StateField, format_time
+from ConfWatcher import ConfWatcher
+from ConnectionPool import Connection, ConnectionPool
+from ProbeRegistry import ProbeRegistry, ProbeFailed
 
 
 class SerMon:
+    __slots__ = ('init_kwargs', 'name', 'timestamp_format', 'name_norm', 'logname', 'host', 'port', 'conn_type',
+                 'priority', 'timeout', 'timeout_sec', 'interval', 'distribution_groups', 'rtt', 'address', 'dns_ms',
+                 'connect_ms', 'tls_ms', 'response_ms', 'probe', 'probe_settings', 'slow_threshold', 'latency', 'row',
+                 '_alert', '_last_alert', '_alert_start', '_alert_count', 'alert_policy', '_fail_streak',
+                 '_recovery_count', 'flapping', 'recent', 'next_interval')
+    # the alert state, in the server's slots or in the alert store
+    alert = StateField()
+    last_alert = StateField()
+    alert_start = StateField()
+    alert_count = StateField()
+    fail_streak = StateField()
+    recovery_count = StateField()
+
+    max_concurrency = 64  # maximum number of probes in flight during check_all()
+    coalesce_window = 1.0  # seconds a probe result is shared with servers that have the same target
+    _probes: Dict[tuple, Tuple[float, asyncio.Future]] = {}  # probe target -> (start, result of the probe)
+    journal: Optional[Journal] = None  # shared by all servers, written once per cycle
+    daemon_jitter = 0.1  # fraction a server interval may vary by in daemon mode
+    daemon_journal_flush = 5  # seconds between journal writes in daemon mode
+    watch_config = True  # apply changes of the servers and notification settings to a running daemon
+    notifier: Optional[Notifier] = None  # shared by all servers
+    digest_window = 10  # seconds to collect notifications for the same recipients into one email
+    notification_timeout = 30  # seconds an SMTP server may take to answer, also bounds the wait at the end of a cycle
+    log_sink: Optional[LogSink] = None  # shared by all servers
+    resolver: Optional[Resolver] = None  # shared DNS cache
+    tls_client: Optional[TlsClient] = None  # shared SSLContext and TLS session cache
+    pool: Optional[ConnectionPool] = None  # connections kept open between protocol probes
+    history: Optional[History] = None  # check history database, None when disabled
+    latency_history = 240  # checks kept in each server's latency ring buffer
+    slow_window = 5  # checks averaged when comparing against a server's slow_threshold
+    metrics = Metrics()  # the monitor's own counters and timings, see sermon.metrics
+    profile_file = ""  # cProfile output written at every flush when set
+    shard: Optional[Shard] = None  # this worker's share of the servers, None when not sharded
+    shard_workers = 1  # worker processes on this node
+    shard_store = ""  # membership, notification claims and the journal shared by all workers
+    shard_heartbeat = 10  # seconds between membership updates in daemon mode
+    shard_node_timeout = 30  # seconds without a heartbeat before a worker's servers move
+    shard_replicas = 64  # points per worker on the hash ring
+    worker_index: Optional[int] = None  # set in worker processes, offsets the metrics port
+    worker_name = ""  # set in worker processes, the name on the hash ring
+    policy = AlertPolicy()  # backoff, flap detection and notification thresholds, see sermon.policy
+    alert_store: Optional[AlertStore] = None  # alert state columns shared by all servers, see sermon.alert_store
+
     defaults = {
         "sermon": {
             "timestamp_format": "%Y-%m-%d %H:%M:%S",
+            "max_concurrency": 64,
+            "coalesce_window": 1,  # seconds, servers with the same address, port, conn_type and timeout share a probe
+            "alert_store": False,  # keep the alert state in shared columns, evaluated once per cycle (large lists)
+            "daemon": {
+                "jitter": 0.1,
+                "journal_flush": 5,
+                "watch_config": True  # apply server and notification changes of this file without a restart
+            },
+            "dns": {
+                "ttl": 300,  # seconds a resolved address is cached
+                "negative_ttl": 30,  # seconds a failed lookup is cached
+                "timeout": 2000  # milliseconds, not counted against the server timeout
+            },
+            "ssl": {
+                "verify": False,  # verify certificate chain and host name
+                "ca_file": "",  # CA bundle for verify (default: system store)
+                "expiry_warning_days": 0,  # fail ssl checks when the certificate expires sooner (needs verify)
+                "session_cache_size": 1024  # host:port TLS sessions kept for resumption
+            },
+            "pool": {
+                "max_idle": 2,  # idle connections kept per target for the next protocol probe (0 = no reuse)
+                "idle_timeout": 30  # seconds, keep it below the targets' keep-alive timeout
+            },
+            "latency": {
+                "history": 240,  # checks kept per server (fixed memory)
+                "slow_window": 5  # checks averaged for slow_threshold
+            },
+            "policy": {
+                "backoff_factor": 2,  # daemon: the interval of a down server grows by this factor per check (1 = off)
+                "backoff_max": 600,  # seconds, never shorter than the server interval
+                "confirm_interval": 5,  # seconds between checks while a failure or recovery is being confirmed
+                "down_checks": 1,  # consecutive failed checks before a server is down
+                "recovery_checks": 1,  # consecutive successful checks before a down server is up again
+                "flap_window": 20,  # checks flapping is measured over
+                "flap_high": 0.5,  # flapping starts when this fraction of the checks changed state (0 = off)
+                "flap_low": 0.25,  # and ends below this fraction
+                "notify_first": 1,  # alert count of the first down notification
+                "notify_every": 10,  # alert count between repeated down notifications (0 = once)
+                "notify_flapping": True  # notify when flapping starts/stops, down/up notifications wait meanwhile
+            },
+            "shard": {
+                "workers": 1,  # worker processes that split the servers between them (1 = no sharding)
+                "store": "sermon-shard.db",  # relative to the script folder, nodes sharing this file share the servers
+                "heartbeat": 10,  # seconds
+                "node_timeout": 30,  # seconds without a heartbeat before a worker's servers move to the others
+                "replicas": 64  # points per worker on the hash ring
+            },
+            "metrics": {
+                "port": 0,  # serve Prometheus metrics on http://host:port/metrics (0 = off)
+                "host": "127.0.0.1",
+                "profile": ""  # write cProfile stats to this file (relative to the script folder, empty = off)
+            },
+            "history": {
+                "enabled": True,
+                "file": "sermon-history.db",  # relative to the script folder
+                "shared": False,  # several nodes write this file (network filesystem): rollback journal, not WAL
+                "retention_days": 90  # raw checks are pruned after this, hourly/daily rollups are kept
+            },
+            "log": {
+                "combined": False,  # one sermon.jsonl file (JSON lines) instead of one .log file per server
+                "max_bytes": 10485760,  # rotate when a file grows beyond this size (0 = never)
+                "backups": 5,
+                "rotate_interval": 0,  # seconds, rotate when the last write was in an earlier period (0 = never)
+                "flush_interval": 5,  # seconds
+                "buffer_size": 65536  # bytes
+            },
             "notification": {
+                "digest_window": 10,
+                "timeout": 30,  # seconds an SMTP server may take to answer, a hung relay cannot stall the checks
                 "smtp": {
                     "default": {
                         "host": "",
@@ -37,10 +173,13 @@ class SerMon:
                     "name": "Google Web Plain",
                     "host": "google.com",
                     "port": 80,  # not used for ping
-                    "conn_type": "plain",
+                    "conn_type": "plain",  # plain, ssl, ping or a protocol: http, https, smtp, smtps, mysql, expect
                     "priority": "high",
                     "timeout": 1000,
-                    "distribution_group": "default"
+                    "interval": 60,
+                    "slow_threshold": 0,  # milliseconds, alert when the average check time is above (0 = off)
+                    "distribution_group": "default",
+                    "probe": {}  # protocol settings, e.g. http: path, method, expect_status, expect_body, headers
                 },
                 {
                     "name": "Google Web SSL",
@@ -49,6 +188,8 @@ class SerMon:
                     "conn_type": "ssl",
                     "priority": "high",
                     "timeout": 1000,
+                    "interval": 60,
+                    "slow_threshold": 0,  # milliseconds, alert when the average check time is above (0 = off)
                     "distribution_group": "default"
                 },
                 {
@@ -58,6 +199,8 @@ class SerMon:
                     "conn_type": "ping",
                     "priority": "high",
                     "timeout": 1000,
+                    "interval": 60,
+                    "slow_threshold": 0,  # milliseconds, alert when the average check time is above (0 = off)
                     "distribution_group": "default"
                 },
             ]
@@ -68,197 +211,1151 @@ class SerMon:
         return str(self.init_kwargs)
 
     def __init__(self, **kwargs):
-        self.init_kwargs = kwargs
+        self.init_kwargs = kwargs  # the config entry (and journal state), compared when the config changes
         self.name = kwargs.get('name', '?')
         self.timestamp_format = kwargs.get('timestamp_format', '%Y-%m-%d %H:%M:%S')
         self.name_norm = self.normalize(self.name)
-        self.logname = f"{BASE_DIR}/{self.name_norm}.log"
+        self.logname = self.get_log_sink().path(self.name_norm)
         self.host = kwargs.get('host', '').lower()
         self.port = kwargs.get('port', 80)
         self.conn_type = kwargs.get('conn_type', 'plain').lower()  # plain (default), ssl, ping
         self.priority = kwargs.get('priority', 'high').lower()
-        self.timeout = kwargs.get('timeout', 1000)
+        self.timeout = kwargs.get('timeout', 1000)  # milliseconds
+        self.timeout_sec = float(self.timeout) / 1000 if str(self.timeout).replace('.', '', 1).isnumeric() else 1.0
+        self.interval = kwargs.get('interval', 60)  # seconds between checks in daemon mode
+        if not str(self.interval).replace('.', '', 1).isnumeric():
+            self.interval = 60
 
         self.distribution_groups = kwargs.get('distribution_groups', {})
+        self.rtt: Optional[float] = None  # round trip time of the last ping in milliseconds
+        self.address: Optional[str] = None  # address the host resolved to for the last check
+        self.dns_ms: Optional[float] = None  # name resolution time of the last check
+        self.connect_ms: Optional[float] = None  # connect (or ping) time of the last check, excludes dns_ms
+        self.tls_ms: Optional[float] = None  # TLS handshake time of the last ssl check, excludes connect_ms
+        self.response_ms: Optional[float] = None  # request/response time of the last protocol probe
+        self.probe = ProbeRegistry.create(self.conn_type, kwargs.get('probe'))  # None for plain, ssl and ping
+        # probes with different settings on the same target do not share results
+        self.probe_settings = repr(sorted(self.probe.settings().items())) if self.probe is not None else None
+        self.slow_threshold = kwargs.get('slow_threshold', 0)
+        if not str(self.slow_threshold).replace('.', '', 1).isnumeric():
+            self.slow_threshold = 0
+        self.latency = LatencyRing(self.latency_history)
+
+        overrides = kwargs.get('policy')  # optional per server sermon.policy settings
+        self.alert_policy = self.policy.with_overrides(**overrides) if type(overrides) is dict else self.policy
+        row = getattr(self, 'row', None)  # set when a changed config entry is applied again, the row is kept
+        if self.alert_store is None:
+            self.row = None
+        elif row is None:
+            self.row = self.alert_store.add(self.alert_policy)
+        else:
+            self.alert_store.set_policy(row, self.alert_policy)
+            self.row = row
 
         self.alert = kwargs.get('alert')
         self.last_alert = kwargs.get('last_alert')
         self.alert_start = kwargs.get('alert_start')
         self.alert_count = kwargs.get('alert_count', 0)
+        # journaled as well, so down_checks and recovery_checks also count across one-shot runs
+        self.fail_streak = kwargs.get('fail_streak') or 0  # consecutive failed checks while not down (down_checks)
+        self.recovery_count = kwargs.get('recovery_count') or 0  # consecutive successful checks while down
+        self.flapping = False
+        self.recent = collections.deque(maxlen=self.alert_policy.flap_window)  # recent results for flap detection
+        self.next_interval = float(self.interval)  # seconds until the next check in daemon mode
 
     @staticmethod
     def normalize(name: str):
         return name.replace(' ', '_')
 
+    @staticmethod
+    def _settings(entry: dict) -> dict:
+        # a server's config entry without the journal state and the resolved distribution group
+        return {k: v for k, v in entry.items() if k not in Journal.fields and k != 'distribution_groups'}
+
     @classmethod
     def load_config(cls):
+        with cls.metrics.timer("load_config_seconds", help_text="Time to load the config and build the servers"):
+            servers = cls._load_config()
+        cls.metrics.set("servers", len(servers), help_text="Configured servers")
+        return servers
+
+    @classmethod
+    def _load_config(cls):
         try:
             conf = ConfQuick("sermon", cls.defaults)
+            if not os.path.exists(conf.conf_file):
+                conf.save()
+            cls.max_concurrency = conf.get("sermon.max_concurrency", cls.max_concurrency, True)
+            cls.coalesce_window = float(conf.get("sermon.coalesce_window", cls.coalesce_window))
+            cls.daemon_jitter = float(conf.get("sermon.daemon.jitter", cls.daemon_jitter))
+            cls.daemon_journal_flush = float(conf.get("sermon.daemon.journal_flush", cls.daemon_journal_flush))
+            cls.watch_config = bool(conf.get("sermon.daemon.watch_config", cls.watch_config))
+            cls.digest_window = float(conf.get("sermon.notification.digest_window", cls.digest_window))
+            cls.notification_timeout = float(conf.get("sermon.notification.timeout", cls.notification_timeout))
+            if cls.notifier is not None:
+                cls.notifier.digest_window = cls.digest_window
+                cls.notifier.timeout = cls.notification_timeout
+            if cls.log_sink is not None:
+                cls.log_sink.flush()
+            log_conf = dict(conf.get("sermon.log", {}))
+            if cls.worker_name:
+                log_conf["combined_name"] = f"sermon-{cls.worker_name}"
+            cls.log_sink = LogSink(BASE_DIR, **log_conf)
+            cls.resolver = Resolver(conf.get("sermon.dns.ttl", 300), conf.get("sermon.dns.negative_ttl", 30),
+                                    float(conf.get("sermon.dns.timeout", 2000)) / 1000)
+            cls.tls_client = TlsClient(**conf.get("sermon.ssl", {}))
+            if cls.pool is not None:
+                cls.pool.close()
+            cls.pool = ConnectionPool(**conf.get("sermon.pool", {}))
+            cls.latency_history = conf.get("sermon.latency.history", cls.latency_history, True)
+            if cls.history is not None:
+                cls.history.close()
+                cls.history = None
+            if conf.get("sermon.history.enabled", True):
+                history_file = conf.get("sermon.history.file", "sermon-history.db")
+                cls.history = History(history_file if os.path.isabs(history_file) else f"{BASE_DIR}/{history_file}",
+                                      conf.get("sermon.history.retention_days", 90),
+                                      bool(conf.get("sermon.history.shared", False)))
+                cls.history.prune()
+            cls.slow_window = conf.get("sermon.latency.slow_window", cls.slow_window, True)
+            cls.policy = AlertPolicy(**conf.get("sermon.policy", {}))
+            cls.alert_store = AlertStore() if conf.get("sermon.alert_store", False) else None
+            cls.shard_workers = max(1, conf.get("sermon.shard.workers", cls.shard_workers, True))
+            shard_store = conf.get("sermon.shard.store", "sermon-shard.db")
+            cls.shard_store = shard_store if os.path.isabs(shard_store) else f"{BASE_DIR}/{shard_store}"
+            cls.shard_heartbeat = float(conf.get("sermon.shard.heartbeat", cls.shard_heartbeat))
+            cls.shard_node_timeout = float(conf.get("sermon.shard.node_timeout", cls.shard_node_timeout))
+            cls.shard_replicas = conf.get("sermon.shard.replicas", cls.shard_replicas, True)
+            if cls.journal is not None:
+                cls.journal.close()
+            # workers keep the journal in the shard store, they would queue for each other to rewrite the file
+            cls.journal = Journal(conf, store=cls.shard_store if cls.worker_name else None)
+            if not cls.worker_name:
+                try:
+                    cls.journal.adopt(cls.shard_store)  # left by the workers of an earlier sharded run
+                except Exception as ex:
+                    print(f"Journal of the shard store not adopted: {ex!r}")
+            metrics_port = int(conf.get("sermon.metrics.port", 0) or 0)
+            if metrics_port and cls.worker_index is not None:
+                metrics_port += cls.worker_index + 1  # the parent keeps the configured port
+            metrics_host = conf.get("sermon.metrics.host", "127.0.0.1")
+            if metrics_port and cls.metrics.server_address != (metrics_host, metrics_port):
+                cls.metrics.serve(metrics_port, metrics_host)
+            elif not metrics_port:
+                cls.metrics.stop_serving()
+            profile_file = conf.get("sermon.metrics.profile", "")
+            cls.profile_file = profile_file if not profile_file or os.path.isabs(profile_file) \
+                else f"{BASE_DIR}/{profile_file}"
+            if cls.profile_file and cls.worker_name:
+                cls.profile_file += f".{cls.worker_name}"
+            if cls.profile_file:
+                cls.metrics.profile_start()
             server_list = conf.get("sermon.servers")
-            groups = conf.get("sermon.notification.distribution_groups")
-            smtp_servers = conf.get("sermon.notification.smtp")
-            my_servers = []
-            for server in server_list:
-                server: dict
-                # merge the journal information for the current server
-                server.update(conf.get(f"journal.{cls.normalize(server.get('name', ''))}", {}))
-                # merge smtp and distribution group settings
-                server['distribution_groups'] = cls._get_group_settings(
-                    server.get('distribution_group', 'default'), groups, smtp_servers)
-                my_servers.append(cls(**server))
-            return my_servers
+            group_settings = cls._compile_groups(conf.get("sermon.notification.distribution_groups"),
+                                                 conf.get("sermon.notification.smtp"))
+            servers = []
+            for entry in server_list or []:
+                try:
+                    servers.append(cls._build_server(entry, group_settings))
+                except Exception as ex:  # one bad entry does not stop the checks of the others
+                    name = entry.get('name', '?') if isinstance(entry, dict) else entry
+                    print(f"Server {name} not loaded: {ex!r}")
+            return servers
         except Exception as ex:
             raise ex
 
     @classmethod
-    def _get_group_settings(cls, group_name: str, groups: dict, smtp_servers: dict) -> dict:
-        final_vals = {}
-        group_data = groups.get(group_name, {}).copy()
-        smtp_name = group_data.get('smtp_server', 'default')
-        smtp_data = smtp_servers.get(smtp_name, {})
-        smtp_data['name'] = smtp_name
-        rec_list = group_data.get('recipients', [])
-        for e_idx in range(len(rec_list) - 1, 0, -1):
-            email = rec_list[e_idx]
-            if '@' not in email and rec_list[e_idx] in groups.keys():
-                rec_list.pop(e_idx)
-                sub_groups = cls._get_group_settings(email, groups, smtp_servers)
-                sub_keys = list(sub_groups.keys())
-                for sub_name in sub_keys:
-                    sub_smtp_name = sub_groups[sub_name].get('smtp_server', {}).get('name')
-                    # TODO: Fix Recipient Inheritance... broken??!?
-                    if sub_smtp_name == smtp_name:  # merge recipient list
-                        for recipient in sub_groups[sub_name].get('recipients', []):
-                            if recipient not in rec_list:
-                                rec_list.append(recipient)
-                        sub_groups.pop(sub_name)
-                final_vals.update(sub_groups)  # potential recursion issue
-        group_data['smtp_server'] = smtp_data
-        group_data['recipients'] = rec_list
-        final_vals[group_name] = group_data
-        return final_vals
+    def _build_server(cls, entry: dict, group_settings: dict) -> 'SerMon':
+        """
+        :param entry: the server's config entry, it is not modified
+        :param group_settings: the compiled distribution groups
+        """
+        kwargs = dict(entry)
+        # merge the journal information for the current server
+        kwargs.update(cls.get_journal().get(cls.normalize(kwargs.get('name', ''))))
+        kwargs['distribution_groups'] = cls._group_for(entry, group_settings)
+        return cls(**kwargs)
+
+    @staticmethod
+    def _group_for(entry: dict, group_settings: dict) -> Dict[str, dict]:
+        # the resolved distribution group, shared by every server in the group
+        group_name = entry.get('distribution_group', 'default')
+        if group_name not in group_settings:
+            print(f"Distribution group {group_name} not found, {entry.get('name', '?')} sends no notifications")
+            group_settings[group_name] = {}
+        return group_settings[group_name]
+
+    def _reconfigure(self, entry: dict, distribution_groups: Dict[str, dict]):
+        """
+        Apply a changed config entry in place, the alert state, latency ring and recent results are kept. If the
+        entry is invalid the server is left as it was and the error is raised
+        :param entry: the server's new config entry
+        :param distribution_groups: the resolved distribution group
+        """
+        state = {f: getattr(self, f) for f in Journal.fields}
+        latency, recent, flapping = self.latency, self.recent, self.flapping
+        previous = {slot: getattr(self, slot) for slot in self.__slots__ if hasattr(self, slot)}
+        try:
+            self.__init__(**{**entry, **state, 'distribution_groups': distribution_groups})
+        except Exception:
+            for slot, value in previous.items():
+                setattr(self, slot, value)
+            raise
+        self.latency = latency
+        self.recent = collections.deque(recent, maxlen=self.alert_policy.flap_window)
+        self.flapping = flapping
+
+    def _release_row(self):
+        # the row goes to the next server that is added, a check still in progress continues on the server's slots
+        if self.row is None:
+            return
+        state = {f: getattr(self, f) for f in Journal.fields}
+        self.alert_store.remove(self.row)
+        self.row = None
+        for field, value in state.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def _apply_config(cls, servers: List['SerMon'], scheduler: Scheduler, conf: ConfQuick):
+        """
+        Apply the servers and notification settings of a changed config to the running daemon without a restart.
+        Servers are matched by name: new ones are scheduled, removed ones stop, changed ones are updated in place and
+        unchanged ones keep running untouched. Other settings take effect after a restart
+        :param servers: the running servers, updated in place
+        :param scheduler: the daemon's scheduler
+        :param conf: the reloaded configuration
+        """
+        cls.digest_window = float(conf.get("sermon.notification.digest_window", cls.digest_window))
+        cls.notification_timeout = float(conf.get("sermon.notification.timeout", cls.notification_timeout))
+        cls.get_notifier().digest_window = cls.digest_window
+        cls.get_notifier().timeout = cls.notification_timeout
+        group_settings = cls._compile_groups(conf.get("sermon.notification.distribution_groups"),
+                                             conf.get("sermon.notification.smtp"))
+        # servers that share a name are matched in order
+        current: Dict[Tuple[str, int], 'SerMon'] = {}
+        seen = collections.Counter()
+        for server in servers:
+            current[(server.name_norm, seen[server.name_norm])] = server
+            seen[server.name_norm] += 1
+        seen.clear()
+        updated = []
+        added = changed = regrouped = failed = 0
+        for entry in conf.get("sermon.servers") or []:
+            name = cls.normalize(entry.get('name', '?'))
+            server = current.pop((name, seen[name]), None)
+            seen[name] += 1
+            if server is None:
+                try:
+                    server = cls._build_server(entry, group_settings)
+                except Exception as ex:
+                    print(f"Server {name} not added: {ex!r}")
+                    failed += 1
+                    continue
+                added += 1
+                if cls.shard is None or cls.shard.owns(server.name_norm):
+                    scheduler.add(server, float(server.interval))
+            elif cls._settings(server.init_kwargs) != cls._settings(entry):
+                try:
+                    server._reconfigure(entry, cls._group_for(entry, group_settings))
+                except Exception as ex:
+                    print(f"Server {name} not changed, it keeps running with its previous settings: {ex!r}")
+                    failed += 1
+                else:
+                    changed += 1
+                    scheduler.update(server, float(server.interval))
+            else:
+                groups = cls._group_for(entry, group_settings)
+                if groups != server.distribution_groups:
+                    regrouped += 1
+                server.distribution_groups = groups  # the same recipients, the new object is shared
+            updated.append(server)
+        for server in current.values():
+            scheduler.remove(server)  # a check in progress finishes but is not queued again
+            server._release_row()
+        servers[:] = updated
+        print(f"Config reloaded: {added} added, {len(current)} removed, {changed} changed, "
+              f"{regrouped} with new recipients" + (f", {failed} not applied" if failed else ""))
+        cls.metrics.inc("config_reloads_total", help_text="Config changes applied to the running daemon")
+        cls.metrics.set("servers", len(servers), help_text="Configured servers")
+
+    @classmethod
+    def _compile_groups(cls, groups: dict, smtp_servers: dict) -> Dict[str, Dict[str, dict]]:
+        """
+        Flatten the distribution groups once per config load. Every group maps to the recipients it reaches, directly
+        or through nested groups, per smtp server. Servers share the result, it must not be modified
+        :param groups: the distribution group settings
+        :param smtp_servers: the smtp server settings
+        :return: {group name: {name of the first group using the smtp server: {'smtp_server', 'recipients'}}}
+        """
+        groups = {k: v for k, v in (groups or {}).items() if type(v) is dict}
+        smtp_servers = smtp_servers or {}
+        smtp_settings = {}
+        cycles = set()
+
+        def members(name):
+            return groups[name].get('recipients') or []
+
+        def is_group(member):
+            return type(member) is str and '@' not in member and member in groups
+
+        def reach(name, path, reached):
+            if name in path:
+                loop = path[path.index(name):]
+                first = loop.index(min(loop))  # the same cycle is found from each of its groups
+                cycles.add(" -> ".join(loop[first:] + loop[:first] + (loop[first],)))
+            elif name not in reached:
+                reached.append(name)
+                for member in members(name):
+                    if is_group(member):
+                        reach(member, path + (name,), reached)
+            return reached
+
+        compiled = {}
+        for group_name in groups:
+            entries: Dict[str, dict] = {}
+            by_smtp: Dict[str, dict] = {}
+            for name in reach(group_name, (), []):
+                smtp_name = groups[name].get('smtp_server', 'default')
+                if smtp_name not in smtp_settings:
+                    smtp_settings[smtp_name] = dict(smtp_servers.get(smtp_name) or {}, name=smtp_name)
+                if smtp_name not in by_smtp:
+                    by_smtp[smtp_name] = entries[name] = {'smtp_server': smtp_settings[smtp_name], 'recipients': []}
+                recipients = by_smtp[smtp_name]['recipients']
+                for member in members(name):
+                    if not is_group(member) and member not in recipients:
+                        recipients.append(member)
+            for entry in entries.values():
+                entry['recipients'] = tuple(entry['recipients'])
+            compiled[group_name] = entries
+        for cycle in sorted(cycles):
+            print(f"Distribution group cycle ignored: {cycle}")
+        return compiled
+
+    @classmethod
+    def get_resolver(cls) -> Resolver:
+        if cls.resolver is None:
+            cls.resolver = Resolver()
+        return cls.resolver
+
+    def _resolve_family(self):
+        return socket.AF_INET if self.conn_type == "ping" else socket.AF_UNSPEC
+
+    def _resolve(self):
+        self.address = None
+        start = time.perf_counter()
+        address = self.get_resolver().resolve(self.host, self._resolve_family())
+        self.dns_ms = (time.perf_counter() - start) * 1000
+        self.address = address
+
+    async def _async_resolve(self):
+        self.address = None
+        start = time.perf_counter()
+        address = await self.get_resolver().async_resolve(self.host, self._resolve_family())
+        self.dns_ms = (time.perf_counter() - start) * 1000
+        self.address = address
+
+    @classmethod
+    def get_tls_client(cls) -> TlsClient:
+        if cls.tls_client is None:
+            cls.tls_client = TlsClient()
+        return cls.tls_client
 
     def _connection(self, use_ssl=False):
-        cn = socket.create_connection((self.host, self.port), timeout=self.timeout)
-        return ssl.wrap_socket(cn) if use_ssl else cn
+        start = time.perf_counter()
+        cn = socket.create_connection((self.address or self.host, self.port), timeout=self.timeout_sec)
+        try:
+            self.connect_ms = (time.perf_counter() - start) * 1000
+            if use_ssl:
+                start = time.perf_counter()
+                cn = self.get_tls_client().wrap_socket(cn, self.host, self.port)
+                self.tls_ms = (time.perf_counter() - start) * 1000
+                # not part of the handshake time
+                self.get_tls_client().receive_ticket(cn, self.host, self.port, self.tls_ms / 1000)
+        finally:
+            cn.close()
+
+    async def _async_open(self, use_ssl=False) -> Connection:
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(self.address or self.host, self.port)
+        self.connect_ms = (time.perf_counter() - start) * 1000
+        stream = None
+        if use_ssl:
+            start = time.perf_counter()
+            stream = await self.get_tls_client().open(reader, writer, self.host, self.port)
+            self.tls_ms = (time.perf_counter() - start) * 1000
+            try:
+                # not part of the handshake time, a greeting that arrives meanwhile is kept for the probe
+                await self.get_tls_client().open_ticket(stream, self.host, self.port, self.tls_ms / 1000)
+            except BaseException:
+                writer.close()
+                raise
+        return Connection(reader, writer, stream)
+
+    async def _async_connection(self, use_ssl=False):
+        await (await self._async_open(use_ssl)).close()
 
-    def _save_log(self, text, show=False):
+    @classmethod
+    def get_pool(cls) -> ConnectionPool:
+        if cls.pool is None:
+            cls.pool = ConnectionPool()
+        return cls.pool
+
+    async def _async_protocol_probe(self, pooled=True):
+        """
+        Run the protocol probe, on an idle connection from an earlier check where the protocol allows it
+        :param pooled: take and return connections from the pool
+        """
+        key = (self.address or self.host, self.port, self.host, self.conn_type)
+        pool = self.get_pool() if pooled else None
+        conn = pool.acquire(key) if pool is not None else None
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = await self._async_open(self.probe.tls)
+            start = time.perf_counter()
+            try:
+                keep = await self.probe.exchange(conn, self.host, self.port)
+            except ConnectionError:
+                conn.abort()
+                if not reused:
+                    raise
+                conn = None  # the target closed the idle connection meanwhile, retry on a new one
+                continue
+            except BaseException:
+                conn.abort()
+                raise
+            self.response_ms = (time.perf_counter() - start) * 1000
+            if reused:
+                self.metrics.inc("connections_reused_total", labels={"conn_type": self.conn_type},
+                                 help_text="Protocol probes that reused a pooled connection")
+            if keep and pool is not None:
+                pool.release(key, conn)
+            else:
+                await conn.close()
+            return
+
+    @classmethod
+    def get_log_sink(cls) -> LogSink:
+        if cls.log_sink is None:
+            cls.log_sink = LogSink(BASE_DIR)
+        return cls.log_sink
+
+    def _save_log(self, text, show=False, **fields):
         if show:
             print(text)
-        with open(self.logname, "a") as f:
-            f.write(f"{text}\n")
+        self.get_log_sink().write(self.name_norm, text, **fields)
+
+    @classmethod
+    def get_journal(cls) -> Journal:
+        if cls.journal is None:
+            cls.journal = Journal(ConfQuick("sermon", cls.defaults))
+        return cls.journal
 
     def _save_state(self):
-        conf = ConfQuick("sermon", self.defaults)
-        conf.set(f"journal.{self.name_norm}.alert", self.alert, False)
-        conf.set(f"journal.{self.name_norm}.last_alert", self.last_alert, False)
-        conf.set(f"journal.{self.name_norm}.alert_start", self.alert_start, False)
-        conf.set(f"journal.{self.name_norm}.alert_count", self.alert_count, False)
-        conf.save()
+        # only recorded here, the journal is written once at the end of the cycle
+        with self.metrics.timer("save_state_seconds", help_text="Time to record one server's alert state"):
+            self.get_journal().record(self.name_norm, alert=self.alert, last_alert=self.last_alert,
+                                      alert_start=self.alert_start, alert_count=self.alert_count,
+                                      fail_streak=self.fail_streak, recovery_count=self.recovery_count)
+
+    def _load_state(self):
+        # take over the alert state another worker recorded for this server
+        state = self.get_journal().get(self.name_norm)
+        self.alert = state.get('alert')
+        self.last_alert = state.get('last_alert')
+        self.alert_start = state.get('alert_start')
+        self.alert_count = state.get('alert_count') or 0
+        self.fail_streak = state.get('fail_streak') or 0
+        self.recovery_count = state.get('recovery_count') or 0
+
+    def _ping_args(self) -> List[str]:
+        ms = platform.system().lower() == "windows"
+        arg = 'n' if ms else 'c'
+        to = 'w' if ms else 'W'
+        wait = str(self.timeout) if ms else str(max(1, round(self.timeout_sec)))  # windows: ms, others: seconds
+        return ["ping", f"-{to}", wait, f"-{arg}", "1", self.host]
+
+    @staticmethod
+    def _ping_output_ok(ping_result: str):
+        return not ('unreachable' in ping_result or 'timed out' in ping_result)
 
     def _ping(self):
+        engine = PingEngine.shared()
+        if engine is None:
+            return self._ping_process()
+        self.rtt = engine.ping(self.address or self.host, self.timeout_sec)
+        return self.rtt is not None
+
+    async def _async_ping(self):
+        engine = PingEngine.shared()
+        if engine is None:
+            return await self._async_ping_process()
+        self.rtt = await engine.async_ping(self.address or self.host, self.timeout_sec)
+        return self.rtt is not None
+
+    def _ping_process(self):
+        # fallback for systems that allow neither ICMP datagram nor raw sockets
         try:
-            ms = platform.system().lower() == "windows"
-            arg = 'n' if ms else 'c'
-            to = 'w' if ms else 'W'
-            ping_result = subprocess.check_output(f"ping -{to} {str(self.timeout)} -{arg} 1 {self.host}",
+            ping_result = subprocess.check_output(" ".join(self._ping_args()),
                                                   shell=True, universal_newlines=True)
-            if 'unreachable' in ping_result or 'timed out' in ping_result:
-                return False
-            else:
-                return True
+            return self._ping_output_ok(ping_result)
         except Exception as err:
             print(repr(err))
             return False
 
+    async def _async_ping_process(self):
+        try:
+            proc = await asyncio.create_subprocess_exec(*self._ping_args(), stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.DEVNULL)
+            try:
+                out, _ = await proc.communicate()
+            except asyncio.CancelledError:
+                proc.kill()
+                raise
+            if proc.returncode != 0:
+                return False
+            return self._ping_output_ok(out.decode(errors="replace"))
+        except (OSError, ValueError) as err:
+            print(repr(err))
+            return False
+
+    @classmethod
+    def get_notifier(cls) -> Notifier:
+        if cls.notifier is None:
+            cls.notifier = Notifier(cls.digest_window, timeout=cls.notification_timeout, metrics=cls.metrics)
+        return cls.notifier
+
     def _send_notification(self, subject, message):
-        from email.mime.text import MIMEText as Message
+        # queued, the notifier delivers from a background thread and never blocks the checks
+        with self.metrics.timer("send_notification_seconds", help_text="Time to queue one notification"):
+            self._queue_notification(subject, message)
+
+    def _queue_notification(self, subject, message):
         for k, v in self.distribution_groups.items():
-            smtp = v.get('smtp_server', {})
-            recipients = v.get('recipients', [])
-            secure_mode = smtp.get("secure_mode", 'plain')
-            from_email = smtp.get("email")
+            def on_error(ex, group_name=k):
+                self._save_log(f"{datetime.now().strftime(self.timestamp_format)} - "
+                               f"Distribution Group: {group_name} FAILED: {repr(ex)}", True)
 
-            if secure_mode == 'ssl':
-                from smtplib import SMTP_SSL as SMTP
-            else:
-                from smtplib import SMTP
+            self.get_notifier().send(v.get('smtp_server', {}), v.get('recipients', []), subject, message, on_error)
+            self.metrics.inc("notifications_total", labels={"group": k}, help_text="Notifications queued")
 
-            try:
-                msg = Message(message, "plain")
-                msg["Subject"] = subject
-                msg["From"] = from_email
-                cn = SMTP(smtp.get("host"), smtp.get("port"))
-                try:
-                    cn.ehlo()
-                    if secure_mode == 'tls':
-                        cn.starttls()
-                        cn.ehlo()
-                    cn.login(smtp.get("username"), smtp.get("password"))
-                    cn.sendmail(from_email, recipients, msg.as_string())
-                finally:
-                    cn.quit()
-            except Exception as ex:
-                self._save_log(f"{datetime.now().strftime(self.timestamp_format)} - "
-                               f"Distribution Group: {k} FAILED: {repr(ex)}", True)
+    def _status_message(self, success: bool, error: Optional[BaseException] = None):
+        target = f"{self.host}:{self.port} using {self.conn_type}"
+        if success and self.conn_type == "ping" and self.rtt is not None:
+            return f"{self.name} is up! {target} ({self.rtt:.1f} ms)"
+        elif success:
+            return f"{self.name} is up! {target}"
+        elif error is not None and self.address is None:
+            return f"{self.name} name resolution failed! {target} error: {repr(error)}"
+        elif isinstance(error, ProbeFailed):
+            return f"{self.name} check failed! {target} error: {error}"
+        elif isinstance(error, (ssl.SSLError, ssl.CertificateError, CertificateExpiring)):
+            return f"{self.name} TLS check failed! {target} error: {repr(error)}"
+        elif isinstance(error, (socket.timeout, asyncio.TimeoutError)):
+            return f"{self.name} connection timed out! {target}"
+        elif isinstance(error, (ConnectionRefusedError, ConnectionResetError)):
+            return f"{self.name} connection failed! {target} error: {repr(error)}"
+        elif error is not None:
+            return f"{self.name} unknown error! {target} error: {repr(error)}"
+        return f"{self.name} did not respond! {target}"
 
     def check_connection(self):
-        message = ""
-        success = False
         now = datetime.now()
-        alert_over = False
-
+        start = time.perf_counter()
+        error = None
+        self.connect_ms = self.tls_ms = self.response_ms = None
         try:
+            self._resolve()
             if self.conn_type == "ping":
                 success = self._ping()
+                self.connect_ms = self.rtt
+            elif self.probe is not None:
+                # blocking callers get a new event loop every time, pooled connections would not outlive it
+                asyncio.run(asyncio.wait_for(self._async_protocol_probe(pooled=False), self.timeout_sec))
+                success = True
             else:
                 self._connection(self.conn_type == "ssl")
                 success = True
-            if success:
-                message = f"{self.name} is up! {self.host}:{self.port} using {self.conn_type}"
-        except socket.timeout:
-            message = f"{self.name} connection timed out! {self.host}:{self.port} using {self.conn_type}"
-        except (ConnectionRefusedError, ConnectionResetError) as e:
-            message = f"{self.name} connection failed! {self.host}:{self.port} using {self.conn_type} error: {repr(e)}"
         except Exception as e:
-            message = f"{self.name} unknown error! {self.host}:{self.port} using {self.conn_type} error: {repr(e)}"
+            success = False
+            error = e
+        self._count_probe(success, time.perf_counter() - start)
+        message = self._process_result(success, self._status_message(success, error), now)
+        self.get_notifier().flush(self.notification_timeout)
+        self.flush_all()
+        return message
+
+    async def async_check_connection(self, limit: Optional[asyncio.Semaphore] = None):
+        """
+        Probe this server without blocking the event loop. Name resolution is bounded by the resolver timeout,
+        the probe itself by the server timeout
+        :param limit: held while resolving and probing, not while waiting for the probe of another server
+        :return: (tuple) success, message, time the probe started
+        """
+        now = datetime.now()
+        start = time.perf_counter()
+        error = None
+        self.connect_ms = self.tls_ms = self.response_ms = None
+        try:
+            await self._limited(limit, self._async_resolve())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            success = False
+            error = e
+        else:
+            success, error = await self._async_shared_probe(limit)
+        self._count_probe(success, time.perf_counter() - start)
+        return success, self._status_message(success, error), now
+
+    def _probe_key(self) -> tuple:
+        # ssl and protocol probes also depend on the host name (SNI, verification, Host header),
+        # ping does not use the port
+        return (self.address or self.host, None if self.conn_type == "ping" else self.port, self.conn_type,
+                self.timeout_sec, self.host if self.conn_type == "ssl" or self.probe is not None else None,
+                self.probe_settings)
+
+    @staticmethod
+    async def _limited(limit: Optional[asyncio.Semaphore], awaitable):
+        if limit is None:
+            return await awaitable
+        async with limit:
+            return await awaitable
+
+    async def _async_shared_probe(self, limit: Optional[asyncio.Semaphore] = None
+                                  ) -> Tuple[bool, Optional[BaseException]]:
+        """
+        Probe the resolved target, or wait for a probe of the same target that is running or finished within
+        coalesce_window and take its result
+        :param limit: held while probing, servers waiting for a shared probe do not take a slot
+        :return: (tuple) success, error
+        """
+        if not self.coalesce_window:
+            return await self._limited(limit, self._async_probe())
+        key = self._probe_key()
+        loop = asyncio.get_running_loop()
+        entry = self._probes.get(key)
+        if entry is not None and entry[1].get_loop() is loop and \
+                (not entry[1].done() or time.monotonic() - entry[0] < self.coalesce_window):
+            success, error, self.connect_ms, self.tls_ms, self.response_ms, self.rtt = await asyncio.shield(entry[1])
+            self.metrics.inc("probes_coalesced_total", labels={"conn_type": self.conn_type},
+                             help_text="Checks that shared the probe of another server with the same target")
+            return success, error
+        result = loop.create_future()
+        SerMon._probes[key] = (time.monotonic(), result)
+        try:
+            success, error = await self._limited(limit, self._async_probe())
+        except BaseException:
+            result.cancel()
+            raise
+        result.set_result((success, error, self.connect_ms, self.tls_ms, self.response_ms, self.rtt))
+        return success, error
+
+    async def _async_probe(self) -> Tuple[bool, Optional[BaseException]]:
+        try:
+            if self.conn_type == "ping":
+                # ping enforces its own timeout, allow a little extra for the process to start and exit
+                success = await asyncio.wait_for(self._async_ping(), self.timeout_sec + 1)
+                self.connect_ms = self.rtt
+            elif self.probe is not None:
+                await asyncio.wait_for(self._async_protocol_probe(), self.timeout_sec)
+                success = True
+            else:
+                await asyncio.wait_for(self._async_connection(self.conn_type == "ssl"), self.timeout_sec)
+                success = True
+            return success, None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return False, e
+
+    def _count_probe(self, success: bool, seconds: float):
+        labels = {"conn_type": self.conn_type}
+        self.metrics.observe("probe_seconds", seconds, labels, "Probe duration including name resolution")
+        self.metrics.inc("checks_total", labels={**labels, "result": "up" if success else "down"},
+                         help_text="Completed probes")
+
+    @classmethod
+    def _write_journal(cls, entries: Dict[str, dict]):
+        """
+        Write entries taken from the journal, safe to call from another thread
+        """
+        with cls.metrics.timer("journal_flush_seconds", help_text="Time to write the journal"):
+            try:
+                cls.get_journal().write(entries)
+            except Exception as ex:
+                # e.g. the config file is being edited and does not parse, the entries are written next time
+                print(f"Journal not written: {ex!r}")
+
+    @classmethod
+    def flush_all(cls, journal: bool = True):
+        """
+        Write the journal, logs and history (and the profile when enabled), timing each
+        :param journal: False when the caller writes the journal itself (the daemon, in another thread)
+        """
+        if journal:
+            cls._write_journal(cls.get_journal().take())
+        with cls.metrics.timer("log_flush_seconds", help_text="Time to write the buffered logs"):
+            cls.get_log_sink().flush()
+        if cls.history is not None:
+            with cls.metrics.timer("history_flush_seconds", help_text="Time to write the buffered check history"):
+                cls.history.flush()
+        if cls.profile_file:
+            cls.metrics.profile_dump(cls.profile_file)
+        if cls.pool is not None:
+            cls.pool.prune()
+            cls.metrics.set("pool_idle_connections", len(cls.pool), help_text="Connections kept for the next probe")
+        now = time.monotonic()
+        SerMon._probes = {key: entry for key, entry in cls._probes.items()
+                          if not entry[1].done() or now - entry[0] < cls.coalesce_window}
+
+    def _record_latency(self, success: bool, message: str):
+        """
+        Store the phase timings of the last check and turn a slow (but up) check into a failure
+        :return: (tuple) success, message
+        """
+        total = None
+        if success:
+            total = sum(t for t in (self.dns_ms, self.connect_ms, self.tls_ms, self.response_ms) if t is not None)
+        self.latency.add(dns=self.dns_ms, connect=self.connect_ms, tls=self.tls_ms, response=self.response_ms,
+                         total=total)
+        if success and float(self.slow_threshold) > 0:
+            average = self.latency.moving_average("total", self.slow_window)
+            if average is not None and average > float(self.slow_threshold):
+                return False, (f"{self.name} is slow! {self.host}:{self.port} using {self.conn_type} "
+                               f"average {average:.1f} ms over the last {self.slow_window} checks "
+                               f"(threshold {self.slow_threshold} ms)")
+        return success, message
+
+    def latency_stats(self, window: Optional[int] = None) -> dict:
+        """
+        :param window: checks for the moving average (default: sermon.latency.slow_window)
+        :return: p50/p95/p99, mean and moving average for each probe phase
+        """
+        return {phase: self.latency.summary(phase, window or self.slow_window) for phase in self.latency.phases}
+
+    def _record_result(self, success: bool, message: str, now: datetime) -> Tuple[bool, str, bool]:
+        """
+        Record the timings and history of a check and update flap detection
+        :return: (tuple) success (False if slow), message, the server was flapping before
+        """
+        success, message = self._record_latency(success, message)
+        if self.history is not None:
+            self.history.record(self.name_norm, success, self.latency.values("total", 1)[-1] if success else None,
+                                now.timestamp())
+        self.recent.append(success)
+        was_flapping = self.flapping
+        self.flapping = self.alert_policy.is_flapping(self.flapping, self.recent)
+        return success, message, was_flapping
+
+    def _process_result(self, success: bool, message: str, now: datetime):
+        alert_over = False
+        success, message, was_flapping = self._record_result(success, message, now)
+        policy = self.alert_policy
+        stamp = now.strftime(self.timestamp_format)
 
         if success is False and not self.alert:
-            self.alert = True
-            self.alert_count = 1
-            self.alert_start = now.strftime(self.timestamp_format)
-            self.last_alert = now.strftime(self.timestamp_format)
+            self.fail_streak += 1
+            if self.fail_streak >= policy.down_checks:
+                self.alert = True
+                self.alert_count = 1
+                self.alert_start = stamp
+                self.last_alert = stamp
+                self.fail_streak = self.recovery_count = 0
             # send the message here
         elif success is True and self.alert is True:
-            self.alert = False
-            alert_over = True
+            self.recovery_count += 1
+            if self.recovery_count >= policy.recovery_checks:
+                self.alert = False
+                alert_over = True
+                self.recovery_count = 0
         elif success is False and self.alert is True:
             if str(self.alert_count).isnumeric():
                 self.alert_count += 1
             else:
                 self.alert_count = 1
-            self.last_alert = now.strftime(self.timestamp_format)
+            self.last_alert = stamp
+            self.recovery_count = 0
+        if success:
+            self.fail_streak = 0
+        self.next_interval = policy.next_interval(float(self.interval), bool(self.alert), int(self.alert_count or 0),
+                                                  bool(self.fail_streak or self.recovery_count), self.flapping)
+
+        # only a failed check moves the alert count, a down server that is recovering is not notified again
+        return self._finish_result(success, message, now, stamp, was_flapping,
+                                   success is False and bool(self.alert) and policy.should_notify(self.alert_count),
+                                   alert_over)
 
+    def _finish_result(self, success: bool, message: str, now: datetime, stamp: str, was_flapping: bool,
+                       notify_down: bool, alert_over: bool, changed: bool = True) -> str:
+        """
+        Journal and log a check and send the notifications it triggered
+        :param stamp: now, formatted with timestamp_format
+        :param notify_down: a down notification is due
+        :param alert_over: the server recovered with this check
+        :param changed: the alert state (or a streak) may have changed and has to be journaled
+        :return: the message
+        """
+        policy = self.alert_policy
         try:
-            self._save_state()
-            self._save_log(f"{now.strftime(self.timestamp_format)} - {message}")
-            if self.alert and (self.alert_count == 1 or self.alert_count % 10 == 0):  # TODO: need to add options
+            if changed:
+                self._save_state()
+            self._save_log(f"{stamp} - {message}", host=self.host, port=self.port,
+                           conn_type=self.conn_type, success=success, alert=self.alert, alert_count=self.alert_count,
+                           address=self.address, dns_ms=self.dns_ms, connect_ms=self.connect_ms, tls_ms=self.tls_ms,
+                           response_ms=self.response_ms)
+            if self.flapping != was_flapping:
+                if policy.notify_flapping and self._claim_notification(f"flapping {now:%Y-%m-%d %H:%M}"):
+                    print("Flapping Notification Triggered.")
+                    state = "DOWN" if self.alert else "UP"
+                    self._send_notification(
+                        f"{self.name} is FLAPPING! Currently {state}" if self.flapping
+                        else f"{self.name} stopped flapping. Currently {state}",
+                        f"{stamp} - {message}")
+            elif self.flapping and policy.notify_flapping:
+                pass  # down/up notifications wait until the server stops flapping
+            elif notify_down and self._claim_notification("down"):
                 print("Alert In-Progress Notification Triggered.")
                 self._send_notification(f"{self.name} is DOWN! [{self.alert_count}] - Alert Started: {self.alert_start}",
-                                        f"{now.strftime(self.timestamp_format)} - {message}")
-            elif alert_over:
+                                        f"{stamp} - {message}")
+            elif alert_over and self._claim_notification("up"):
                 print("Alert Complete Notification Triggered.")
                 self._send_notification(
                     f"{self.name} is BACK UP! [{self.alert_count}] - Alert Started: {self.alert_start}",
-                    f"{now.strftime(self.timestamp_format)} - {message}")
+                    f"{stamp} - {message}")
         except Exception as e:
             message += f"\n{repr(e)}"
         return message
 
+    @classmethod
+    def _process_results(cls, servers: List['SerMon'], results: List[tuple]) -> List[str]:
+        """
+        Record one cycle of results with the alert transitions of all servers evaluated in a single pass over the alert
+        store, then log and notify per server. Only changed alert states are journaled and each timestamp is formatted
+        once per cycle
+        :param servers: servers with a row in the alert store
+        :param results: (success, message, time the probe started) per server
+        :return: the messages in the same order
+        """
+        recorded = [server._record_result(*result) for server, result in zip(servers, results)]
+        times = [int(now.timestamp()) for _, _, now in results]
+        masks = cls.alert_store.evaluate([server.row for server in servers], [r[0] for r in recorded], times)
+        messages = []
+        for i, (server, (success, message, was_flapping), epoch) in enumerate(zip(servers, recorded, times)):
+            # next_interval only matters to the daemon, which processes every check on its own
+            messages.append(server._finish_result(success, message, results[i][2],
+                                                  format_time(epoch, server.timestamp_format), was_flapping,
+                                                  masks["notify"][i], masks["up"][i], masks["changed"][i]))
+        return messages
+
+    def _claim_notification(self, kind: str) -> bool:
+        # while servers move between workers two of them may see the same alert step, only the first one notifies
+        return self.shard is None or self.shard.claim(self.name_norm, f"{kind} {self.alert_start} {self.alert_count}")
+
+    @classmethod
+    async def async_check_all(cls, servers: Optional[List['SerMon']] = None, concurrency: Optional[int] = None):
+        """
+        Probe every server concurrently, then record the results in order
+        :param servers: the servers to check (defaults to the servers from load_config)
+        :param concurrency: the maximum number of probes in flight (defaults to sermon.max_concurrency)
+        :return: a list of result messages in the same order as the servers
+        """
+        if servers is None:
+            servers = cls.load_config()
+        start = time.perf_counter()
+        limit = asyncio.Semaphore(max(1, int(concurrency or cls.max_concurrency)))
+
+        async def probe(server: 'SerMon'):
+            return await server.async_check_connection(limit)
+
+        # servers with the same target start one after the other so they share one probe
+        tasks = [None] * len(servers)
+        for i in sorted(range(len(servers)), key=lambda i: (servers[i].host, str(servers[i].port),
+                                                            servers[i].conn_type, servers[i].timeout_sec)):
+            tasks[i] = asyncio.ensure_future(probe(servers[i]))
+        results = await asyncio.gather(*tasks)
+        # journal, log and notification handling stays sequential so the shared files are not written concurrently
+        if cls.alert_store is not None and all(s.row is not None for s in servers):
+            messages = cls._process_results(servers, results)
+        else:
+            messages = [s._process_result(*result) for s, result in zip(servers, results)]
+        # a one-shot cycle does not wait for the digest window, everything from this cycle goes out together
+        if not await asyncio.get_running_loop().run_in_executor(None, cls.get_notifier().flush,
+                                                                cls.notification_timeout):
+            print(f"Notifications not delivered within {cls.notification_timeout:g}s, still trying")
+        cls.flush_all()
+        cls.metrics.set("cycle_seconds", time.perf_counter() - start, help_text="Duration of the last check_all cycle")
+        cls.metrics.set("cycle_servers", len(servers), help_text="Servers checked in the last check_all cycle")
+        return messages
+
+    @classmethod
+    def check_all(cls, servers: Optional[List['SerMon']] = None, concurrency: Optional[int] = None):
+        """
+        Blocking wrapper around async_check_all
+        :param servers: the servers to check (defaults to the servers from load_config)
+        :param concurrency: the maximum number of probes in flight (defaults to sermon.max_concurrency)
+        :return: a list of result messages in the same order as the servers
+        """
+        async def cycle():
+            try:
+                return await cls.async_check_all(servers, concurrency)
+            finally:
+                cls.get_pool().close()  # the connections belong to this event loop
+
+        return asyncio.run(cycle())
+
+    @classmethod
+    async def async_run_daemon(cls, servers: Optional[List['SerMon']] = None, concurrency: Optional[int] = None,
+                               watch: Optional[bool] = None):
+        """
+        Check every server on its own interval until cancelled. The config is loaded once, later changes of the servers
+        and notification settings are applied as they are saved
+        :param servers: the servers to check (defaults to the servers from load_config)
+        :param concurrency: the maximum number of probes in flight (defaults to sermon.max_concurrency)
+        :param watch: apply config file changes to the servers (default: sermon.daemon.watch_config if the servers
+            come from the config)
+        """
+        if watch is None:
+            watch = cls.watch_config and servers is None
+        if servers is None:
+            servers = cls.load_config()
+        scheduler = Scheduler(cls.daemon_jitter)
+        moved = set()
+        if cls.shard is not None:
+            # like any other move the first servers are taken over at the next heartbeat,
+            # workers that start together see each other by then
+            cls.shard.heartbeat()
+            moved = cls._rebalance(servers, scheduler, moved)
+        else:
+            for server in servers:
+                scheduler.add(server, float(server.interval))  # first run at a random point within the interval
+        limit = asyncio.Semaphore(max(1, int(concurrency or cls.max_concurrency)))
+        running = set()
+
+        async def run_check(server: 'SerMon'):
+            try:
+                print(server._process_result(*await server.async_check_connection(limit)))
+            finally:
+                scheduler.reschedule(server, interval=server.next_interval)
+
+        journal = cls.get_journal()
+        watcher = ConfWatcher(journal.conf.conf_file) if watch else None
+        generation = journal.generation
+        changed = asyncio.Event()  # set when inotify reports a change of the config file
+        wake = asyncio.Event()  # ends the wait for the next check early
+        loop = asyncio.get_running_loop()
+        if watcher is not None and watcher.fileno() is not None:
+            loop.add_reader(watcher.fileno(), lambda: watcher.changed() and (changed.set(), wake.set()))
+        # reading and writing the config file takes seconds for long server lists, it runs in another thread
+        # (one job at a time) so the checks keep running
+        file_job: Optional[asyncio.Future] = None
+        journal_due = False
+        last_flush = last_heartbeat = time.monotonic()
+        tick = cls.daemon_journal_flush if cls.shard is None else min(cls.daemon_journal_flush, cls.shard_heartbeat)
+        try:
+            while True:
+                wake.clear()
+                if file_job is not None and file_job.done():
+                    if not file_job.cancelled() and file_job.exception() is not None:
+                        print(f"Config not reloaded: {file_job.exception()!r}")
+                    file_job = None
+                if file_job is None and journal.generation != generation:
+                    # the file changed, noticed by a reload or while writing the journal
+                    generation = journal.generation
+                    try:
+                        with cls.metrics.timer("config_reload_seconds", help_text="Time to apply a config change"):
+                            cls._apply_config(servers, scheduler, journal.conf)
+                    except Exception as ex:
+                        print(f"Config not applied: {ex!r}")
+                if file_job is None and (changed.is_set() or
+                                         watcher is not None and watcher.fileno() is None and watcher.changed()):
+                    changed.clear()
+                    file_job = loop.run_in_executor(None, journal.refresh)  # the journal's own writes do not count
+                    file_job.add_done_callback(lambda _: wake.set())
+                now = time.monotonic()
+                due = scheduler.pop_due(now)
+                if due:
+                    cls.metrics.set("schedule_lag_seconds", scheduler.lag,
+                                    help_text="How far the most overdue check was behind schedule when started")
+                for server in due:
+                    task = asyncio.ensure_future(run_check(server))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                cls.metrics.set("checks_in_flight", len(running), help_text="Probes running or waiting for a slot")
+                if now - last_flush >= cls.daemon_journal_flush:
+                    cls.flush_all(journal=False)
+                    journal_due = True
+                    last_flush = now
+                if journal_due and file_job is None:
+                    journal_due = False
+                    if journal.dirty:
+                        file_job = loop.run_in_executor(None, cls._write_journal, journal.take())
+                        file_job.add_done_callback(lambda _: wake.set())
+                if cls.shard is not None and now - last_heartbeat >= cls.shard_heartbeat:
+                    if cls.shard.heartbeat() or moved:
+                        moved = cls._rebalance(servers, scheduler, moved)
+                    last_heartbeat = now
+                next_due = scheduler.next_due()
+                wait = tick if next_due is None else next_due - time.monotonic()
+                try:
+                    await asyncio.wait_for(wake.wait(), min(max(wait, 0), tick))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if watcher is not None:
+                if watcher.fileno() is not None:
+                    loop.remove_reader(watcher.fileno())
+                watcher.close()
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            if file_job is not None:
+                await asyncio.gather(file_job, return_exceptions=True)
+            cls.get_pool().close()
+            cls.get_notifier().close(cls.notification_timeout)
+            cls.flush_all()
+            if cls.shard is not None:
+                cls.shard.leave()
+
+    @classmethod
+    def _rebalance(cls, servers: List['SerMon'], scheduler: Scheduler, moved: set) -> set:
+        """
+        Follow a change of the workers: stop checking the servers that moved away right away, take over the ones that
+        moved here one heartbeat later so their previous owner has written their state by then
+        :param moved: names of the servers that moved here at the previous heartbeat
+        :return: names of the servers that moved here since
+        """
+        cls.flush_all()
+        gained = []
+        moving = set()
+        for server in servers:
+            if not cls.shard.owns(server.name_norm):
+                if server in scheduler:
+                    scheduler.remove(server)
+            elif server not in scheduler:
+                if server.name_norm in moved:
+                    gained.append(server)
+                else:
+                    moving.add(server.name_norm)
+        if gained:
+            cls.get_journal().refresh()
+            if cls.history is not None:
+                cls.history.refresh_open()
+            for server in gained:
+                server._load_state()
+                scheduler.add(server, float(server.interval))
+        cls.metrics.set("shard_members", len(cls.shard.members), help_text="Live workers on the hash ring")
+        cls.metrics.set("shard_servers", len(scheduler), help_text="Servers owned by this worker")
+        return moving
+
+    @classmethod
+    def run_daemon(cls, servers: Optional[List['SerMon']] = None, concurrency: Optional[int] = None,
+                   watch: Optional[bool] = None):
+        """
+        Blocking wrapper around async_run_daemon, stops cleanly on SIGINT/SIGTERM
+        """
+        async def main():
+            task = asyncio.ensure_future(cls.async_run_daemon(servers, concurrency, watch))
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, task.cancel)
+                except (NotImplementedError, RuntimeError):
+                    pass  # not supported on windows, KeyboardInterrupt still stops the loop
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run(main())
+
+    @classmethod
+    def _shard_worker(cls, index: int, name: str, nodes: Optional[List[str]], daemon: bool):
+        """
+        Entry point of a worker process
+        :param index: the worker number on this node
+        :param name: the worker name on the hash ring, unique across nodes
+        :param nodes: the fixed workers of a one-shot cycle, None to coordinate through the shard store
+        :param daemon: run the daemon instead of one cycle
+        :return: (index in the server list, message) for the servers this worker checked
+        """
+        cls.worker_index, cls.worker_name = index, name
+        servers = cls.load_config()
+        cls.shard = Shard(name, None if nodes else cls.shard_store, nodes, cls.shard_node_timeout, cls.shard_replicas)
+        if daemon:
+            cls.run_daemon(servers, watch=cls.watch_config)
+            return []
+        mine = [i for i, server in enumerate(servers) if cls.shard.owns(server.name_norm)]
+        messages = cls.check_all([servers[i] for i in mine])
+        cls.get_notifier().close(cls.notification_timeout)
+        cls.get_log_sink().flush()  # delivery failures are logged while closing
+        return list(zip(mine, messages))
+
+    @classmethod
+    def check_all_sharded(cls, workers: int) -> List[str]:
+        """
+        One cycle with the servers split over worker processes by consistent hashing of the normalized name
+        :param workers: the number of worker processes
+        :return: a list of result messages in the same order as the configured servers
+        """
+        names = [f"worker-{i}" for i in range(workers)]
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            parts = pool.starmap(cls._shard_worker, [(i, name, names, False) for i, name in enumerate(names)])
+        return [message for _, message in sorted(itertools.chain.from_iterable(parts))]
+
+    @classmethod
+    def run_daemon_sharded(cls, workers: int, node: Optional[str] = None):
+        """
+        Run the daemon in worker processes that split the servers between them. Workers on other nodes that use
+        the same shard store join the same hash ring. Stops cleanly on SIGINT/SIGTERM
+        :param workers: the number of worker processes on this node
+        :param node: the name of this node (default: the host name)
+        """
+        node = node or Shard.default_node()
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=cls._shard_worker, args=(i, f"{node}-{i}", None, True),
+                                     name=f"SerMon-{node}-{i}") for i in range(workers)]
+        for process in processes:
+            process.start()
+
+        def stop(*_):
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()  # SIGTERM, the worker flushes and leaves the ring
+
+        previous = signal.signal(signal.SIGTERM, stop)
+        try:
+            for process in processes:
+                while True:
+                    try:
+                        process.join()
+                        break
+                    except KeyboardInterrupt:
+                        stop()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
 
 # a yaml file will be generated when the script is run the first time
 if __name__ == '__main__':
-    servers = SerMon.load_config()
+    parser = argparse.ArgumentParser(description="Monitor servers and send notifications when they go down")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and check each server on its own interval")
+    parser.add_argument("--workers", type=int,
+                        help="split the servers over this many worker processes (default: sermon.shard.workers)")
+    parser.add_argument("--node", help="join the hash ring of other nodes sharing sermon.shard.store under this name")
+    args = parser.parse_args()
+    workers = args.workers or ConfQuick("sermon", SerMon.defaults).get("sermon.shard.workers", 1, True)
 
-    for s in servers:
-        print(s.check_connection())
+    if args.daemon and (workers > 1 or args.node):
+        SerMon.run_daemon_sharded(workers, args.node)
+    elif args.daemon:
+        SerMon.run_daemon()
+    elif workers > 1:
+        for result in SerMon.check_all_sharded(workers):
+            print(result)
+    else:
+        for result in SerMon.check_all():
+            print(result)
+        SerMon.get_notifier().close(SerMon.notification_timeout)
+        SerMon.get_log_sink().flush()  # delivery failures are logged while closing
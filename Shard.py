@@ -0,0 +1,99 @@
+import socket
+import sqlite3
+import time
+from typing import Iterable, List, Optional
+from HashRing import HashRing
+
+
+class Shard:
+    """
+    One worker's share of the server list. With a store, workers (on this or other nodes) register in a shared SQLite
+    database and heartbeat, the live members form a consistent hash ring and a worker that stops heartbeating hands its
+    servers over. The store also de-duplicates notifications while ownership moves. It uses a rollback journal rather
+    than WAL, which only works on one host, so nodes can share it on a network filesystem with working file locks.
+    Without a store the members are fixed (a local worker pool for one cycle)
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS members (node TEXT PRIMARY KEY, heartbeat REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS claims (
+            server TEXT NOT NULL, event TEXT NOT NULL, node TEXT NOT NULL, ts REAL NOT NULL,
+            PRIMARY KEY (server, event));
+    """
+    claim_retention = 86400  # seconds notification claims are kept
+
+    def __init__(self, node: str, store: Optional[str] = None, nodes: Optional[Iterable[str]] = None,
+                 node_timeout: float = 30, replicas: int = 64):
+        """
+        :param node: the name of this worker, unique across all nodes
+        :param store: the shared SQLite database (every node must see the same file), None for fixed members
+        :param nodes: the fixed members when there is no store (default: only this worker)
+        :param node_timeout: seconds without a heartbeat before a worker's servers move to the others
+        :param replicas: points per worker on the hash ring
+        """
+        self.node = node
+        self.store = store
+        self.node_timeout = float(node_timeout)
+        self.ring = HashRing(nodes or [node], replicas)
+        self._db: Optional[sqlite3.Connection] = None
+        if store:
+            self._db = sqlite3.connect(store, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=DELETE")
+            self._db.executescript(self.schema)
+
+    def owns(self, name: str) -> bool:
+        """
+        :param name: the normalized server name
+        """
+        return self.ring.node_for(name) == self.node
+
+    def heartbeat(self, now: Optional[float] = None) -> bool:
+        """
+        Announce this worker and rebuild the ring from the live members
+        :return: True if the members changed
+        """
+        if self._db is None:
+            return False
+        now = time.time() if now is None else now
+        self._db.execute("INSERT INTO members (node, heartbeat) VALUES (?, ?) "
+                         "ON CONFLICT (node) DO UPDATE SET heartbeat = excluded.heartbeat", (self.node, now))
+        self._db.execute("DELETE FROM claims WHERE ts < ?", (now - self.claim_retention,))
+        live = {node for node, in self._db.execute(
+            "SELECT node FROM members WHERE heartbeat >= ?", (now - self.node_timeout,))}
+        live.add(self.node)
+        if live == set(self.ring.nodes):
+            return False
+        for node in set(self.ring.nodes) - live:
+            self.ring.remove(node)
+        for node in live:
+            self.ring.add(node)
+        return True
+
+    @property
+    def members(self) -> List[str]:
+        return self.ring.nodes
+
+    def claim(self, server: str, event: str) -> bool:
+        """
+        Take the right to act on an event once across all workers (e.g. a notification for one alert step)
+        :param server: the normalized server name
+        :param event: identifies the event for that server
+        :return: True if this worker was first
+        """
+        if self._db is None:
+            return True
+        return self._db.execute("INSERT OR IGNORE INTO claims (server, event, node, ts) VALUES (?, ?, ?, ?)",
+                                (server, event, self.node, time.time())).rowcount == 1
+
+    def leave(self):
+        """
+        Remove this worker from the members so its servers move right away instead of after node_timeout
+        """
+        if self._db is not None:
+            self._db.execute("DELETE FROM members WHERE node = ?", (self.node,))
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def default_node() -> str:
+        return socket.gethostname() or "node"
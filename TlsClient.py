@@ -0,0 +1,251 @@
+import asyncio
+import select
+import socket
+import ssl
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class CertificateExpiring(Exception):
+    pass
+
+
+class AsyncTlsStream:
+    """
+    TLS over an asyncio stream, driven through memory BIOs. asyncio's own TLS transport cannot resume a session,
+    this can
+    """
+    read_size = 65536
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, sslobj: ssl.SSLObject,
+                 incoming: ssl.MemoryBIO, outgoing: ssl.MemoryBIO):
+        self.reader = reader
+        self.writer = writer
+        self.sslobj = sslobj
+        self._incoming = incoming
+        self._outgoing = outgoing
+        self._pending = bytearray()  # application data decrypted by poll(), returned by the next read()
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: bytes of application data decrypted but not read yet
+        """
+        return len(self._pending)
+
+    async def _flush(self):
+        data = self._outgoing.read()
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def _fill(self, timeout: Optional[float] = None):
+        data = await asyncio.wait_for(self.reader.read(self.read_size), timeout)
+        if data:
+            self._incoming.write(data)
+        else:
+            self._incoming.write_eof()
+
+    async def handshake(self):
+        while True:
+            try:
+                self.sslobj.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                await self._flush()
+                if self._incoming.eof:
+                    raise ConnectionResetError("connection closed during the TLS handshake")
+                await self._fill()
+        await self._flush()
+
+    async def read(self, size: int = read_size, timeout: Optional[float] = None) -> bytes:
+        """
+        Read decrypted data, b"" once the peer closed the connection
+        """
+        if self._pending:
+            data = bytes(self._pending[:size])
+            del self._pending[:size]
+            return data
+        while True:
+            try:
+                return self.sslobj.read(size)
+            except ssl.SSLWantReadError:
+                if self._incoming.eof:
+                    return b""
+                await self._flush()
+                await self._fill(timeout)
+            except ssl.SSLZeroReturnError:
+                return b""
+
+    async def write(self, data: bytes):
+        self.sslobj.write(data)
+        await self._flush()
+
+    async def poll(self, timeout: float):
+        """
+        Process whatever the peer sends within the timeout without waiting for application data
+        (TLS 1.3 session tickets arrive after the handshake). Application data that arrives with it, e.g. the
+        greeting of a server that speaks first, is kept for read()
+        """
+        try:
+            await self._fill(timeout)
+            while True:
+                data = self.sslobj.read(self.read_size)
+                if not data:
+                    break
+                self._pending += data
+        except (asyncio.TimeoutError, ssl.SSLWantReadError, ssl.SSLZeroReturnError):
+            pass
+
+    async def close(self):
+        try:
+            self.sslobj.unwrap()
+        except (ssl.SSLError, OSError):
+            pass
+        try:
+            await self._flush()
+        except (ConnectionError, OSError):
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class TlsClient:
+    """
+    One shared SSLContext for all TLS probes plus a cache of TLS sessions per host:port, so repeated probes
+    resume the session instead of doing a full handshake
+    """
+    read_size = 65536
+
+    def __init__(self, verify: bool = False, ca_file: str = "", expiry_warning_days: float = 0,
+                 session_cache_size: int = 1024):
+        """
+        :param verify: verify the certificate chain and host name (the default only encrypts, like ssl.wrap_socket)
+        :param ca_file: a CA bundle to verify against instead of the system store
+        :param expiry_warning_days: fail the probe if the certificate expires within this many days
+            (needs verify, an unverified certificate cannot be decoded by the ssl module)
+        :param session_cache_size: the number of host:port sessions to keep
+        """
+        self.verify = bool(verify)
+        self.expiry_warning_days = float(expiry_warning_days or 0)
+        self.session_cache_size = int(session_cache_size)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if self.verify:
+            if ca_file:
+                self.context.load_verify_locations(ca_file)
+            else:
+                self.context.load_default_certs()
+        else:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self._sessions: 'OrderedDict[Tuple[str, int], ssl.SSLSession]' = OrderedDict()
+
+    def _session(self, key: Tuple[str, int]) -> Optional[ssl.SSLSession]:
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+        return session
+
+    def _store_session(self, key: Tuple[str, int], session: Optional[ssl.SSLSession]):
+        if session is None or not self.session_cache_size:
+            return
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.session_cache_size:
+            self._sessions.popitem(last=False)
+
+    def _check_certificate(self, cert: Optional[dict]):
+        if not self.expiry_warning_days or not cert or 'notAfter' not in cert:
+            return
+        days = (ssl.cert_time_to_seconds(cert['notAfter']) - time.time()) / 86400
+        if days < self.expiry_warning_days:
+            raise CertificateExpiring(f"certificate expires in {days:.1f} days ({cert['notAfter']})")
+
+    def wrap_socket(self, sock: socket.socket, host: str, port: int) -> ssl.SSLSocket:
+        """
+        Do the TLS handshake on a connected socket, resuming a cached session where possible. Call receive_ticket()
+        afterwards so a TLS 1.3 session can be resumed next time
+        :param sock: the connected socket (closed if the handshake fails)
+        :param host: the host name, sent for SNI and used for verification
+        :param port: the port, part of the session cache key
+        :return: the TLS socket
+        """
+        try:
+            tls = self.context.wrap_socket(sock, server_hostname=host or None, session=self._session((host, port)))
+        except Exception:
+            sock.close()
+            raise
+        try:
+            self._check_certificate(tls.getpeercert())
+            self._store_session((host, port), tls.session)
+        except Exception:
+            tls.close()
+            raise
+        return tls
+
+    def receive_ticket(self, tls: ssl.SSLSocket, host: str, port: int, wait: float):
+        """
+        Wait for the TLS 1.3 session ticket, which arrives after the handshake, and cache the session. Data received
+        with it is discarded, only use it on sockets that are closed next
+        :param tls: the socket returned by wrap_socket()
+        :param wait: seconds, about one round trip (the handshake time), at most 1
+        """
+        if tls.session_reused or tls.version() != "TLSv1.3":
+            return
+        if select.select([tls], [], [], min(wait, 1.0))[0]:
+            timeout = tls.gettimeout()
+            tls.settimeout(0.0)
+            try:
+                tls.recv(self.read_size)
+            except (ssl.SSLWantReadError, ssl.SSLZeroReturnError, BlockingIOError):
+                pass
+            finally:
+                tls.settimeout(timeout)
+        self._store_session((host, port), tls.session)
+
+    async def open(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                   host: str, port: int) -> AsyncTlsStream:
+        """
+        Do the TLS handshake on a connected asyncio stream, resuming a cached session where possible. Await
+        open_ticket() afterwards so a TLS 1.3 session can be resumed next time
+        :param reader: the stream reader
+        :param writer: the stream writer (closed if the handshake fails)
+        :param host: the host name, sent for SNI and used for verification
+        :param port: the port, part of the session cache key
+        :return: the TLS stream
+        """
+        key = (host, port)
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        sslobj = self.context.wrap_bio(incoming, outgoing, server_hostname=host or None, session=self._session(key))
+        stream = AsyncTlsStream(reader, writer, sslobj, incoming, outgoing)
+        try:
+            await stream.handshake()
+            self._check_certificate(sslobj.getpeercert())
+            self._store_session(key, sslobj.session)
+        except BaseException:
+            writer.close()
+            raise
+        return stream
+
+    async def open_ticket(self, stream: AsyncTlsStream, host: str, port: int, wait: float):
+        """
+        Wait for the TLS 1.3 session ticket, which arrives after the handshake, and cache the session. Application
+        data received meanwhile stays readable from the stream
+        :param stream: the stream returned by open()
+        :param wait: seconds, about one round trip (the handshake time), at most 1
+        """
+        if stream.sslobj.session_reused or stream.sslobj.version() != "TLSv1.3":
+            return
+        await stream.poll(min(wait, 1.0))
+        self._store_session((host, port), stream.sslobj.session)
+
+    def forget(self, host: Optional[str] = None):
+        """
+        Drop cached sessions for a host, or for every host
+        """
+        for key in [k for k in self._sessions if host is None or k[0] == host]:
+            self._sessions.pop(key, None)
@@ -0,0 +1,45 @@
+"""
+ConfQuick.get / ConfQuick.set cost as the configuration grows
+
+usage: python benchmarks/bench_confquick.py [server_count ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ConfQuick import ConfQuick  # noqa: E402
+
+
+def build_config(server_count: int) -> dict:
+    return {
+        "sermon": {
+            "servers": [{"name": f"server_{i}", "host": f"10.0.{i // 250}.{i % 250}", "port": 443,
+                         "conn_type": "ssl", "timeout": 1000} for i in range(server_count)],
+        },
+        "journal": {f"server_{i}": {"alert": False, "last_alert": None, "alert_start": None, "alert_count": 0}
+                    for i in range(server_count)},
+    }
+
+
+def measure(func, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def run(server_count: int, iterations: int = 2000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conf = ConfQuick("bench", build_config(server_count), custom_file_path=f"{temp_dir}/bench-conf.yaml")
+        get_us = measure(lambda i: conf.get(f"journal.server_{i % server_count}.alert_count"), iterations)
+        list_us = measure(lambda i: conf.get(f"sermon.servers.{i % server_count}.host"), iterations)
+        set_us = measure(lambda i: conf.set(f"journal.server_{i % server_count}.alert_count", i, False), iterations)
+    print(f"{server_count:>8} servers | get {get_us:8.2f} us | get (list) {list_us:8.2f} us | set {set_us:8.2f} us")
+
+
+if __name__ == '__main__':
+    for n in [int(a) for a in sys.argv[1:]] or [10, 100, 1000, 5000, 10000]:
+        run(n)
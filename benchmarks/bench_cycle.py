@@ -0,0 +1,292 @@
+"""
+End-to-end SerMon benchmark against simulated targets on the loopback interface
+
+Starts one listener per server (plain TCP, TLS, refusing and blackholed), a local SMTP stand-in and writes a
+matching sermon-conf.yaml into a scratch copy of SerMon, then measures in a fresh process per size:
+config load time, ConfQuick.get throughput, journal write cost, check_connection, check_all cycle time and
+peak memory. Nothing outside the scratch folder is touched.
+
+usage: python benchmarks/bench_cycle.py [--mix plain=80,ssl=10,refused=5,blackholed=5] [--timeout 500]
+                                        [server_count ...]
+"""
+import argparse
+import asyncio
+import copy
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the worker imports the scratch copy so logs, journal and history stay in the scratch folder
+sys.path.insert(0, sys.argv[sys.argv.index("--worker") + 1] if "--worker" in sys.argv[:-1] else REPO_DIR)
+
+from ConfQuick import ConfQuick  # noqa: E402
+from SerMon import SerMon  # noqa: E402
+
+
+def raise_file_limit(needed: int):
+    try:
+        import resource
+    except ImportError:
+        return  # windows, nothing to raise
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard == resource.RLIM_INFINITY else min(needed, hard),
+                                                    hard))
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Targets:
+    """
+    Loopback listeners served from an event loop thread:
+    plain accepts and closes, ssl completes the handshake first, refused is bound but never listens and
+    blackholed listens with a full backlog so new connections are never answered
+    """
+
+    def __init__(self, cert_dir: str):
+        self.cert_dir = cert_dir
+        self.loop = asyncio.new_event_loop()
+        self.servers = []
+        self.sockets = []  # refused/blackholed sockets and the connections that fill the backlogs
+        self.smtp_messages = 0
+        self.smtp_port = None
+        self._tls_context = None
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bench-targets", daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def tls_context(self):
+        if self._tls_context is None:
+            cert, key = f"{self.cert_dir}/cert.pem", f"{self.cert_dir}/key.pem"
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                            "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._tls_context.load_cert_chain(cert, key)
+        return self._tls_context
+
+    @staticmethod
+    async def _hang_up(reader, writer):
+        writer.close()
+
+    async def _listen(self, tls):
+        server = await asyncio.start_server(self._hang_up, "127.0.0.1", 0, backlog=4096,
+                                            ssl=self.tls_context() if tls else None)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    def _refused(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))  # keeps the port reserved, connections are refused
+        self.sockets.append(sock)
+        return sock.getsockname()[1]
+
+    def _blackholed(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(0)
+        port = sock.getsockname()[1]
+        # fill the accept queue, the listener never accepts so later SYNs are dropped and probes time out
+        for _ in range(3):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(("127.0.0.1", port))
+            self.sockets.append(filler)
+        self.sockets.append(sock)
+        return port
+
+    def open(self, kind: str) -> int:
+        """
+        :param kind: plain, ssl, refused or blackholed
+        :return: the port of a new listener
+        """
+        if kind == "refused":
+            return self._refused()
+        if kind == "blackholed":
+            return self._blackholed()
+        return self._run(self._listen(kind == "ssl"))
+
+    async def _smtp_session(self, reader, writer):
+        def reply(line):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 bench ESMTP")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                reply("250 bench")
+            elif command == b"DATA":
+                reply("354 go ahead")
+                while (await reader.readline()) not in (b".\r\n", b""):
+                    pass
+                self.smtp_messages += 1
+                reply("250 queued")
+            elif command == b"QUIT":
+                reply("221 bye")
+                break
+            else:
+                reply("250 ok")
+            await writer.drain()
+        writer.close()
+
+    def start_smtp(self) -> int:
+        async def start():
+            server = await asyncio.start_server(self._smtp_session, "127.0.0.1", 0)
+            self.servers.append(server)
+            return server.sockets[0].getsockname()[1]
+
+        self.smtp_port = self._run(start())
+        return self.smtp_port
+
+    def close(self):
+        async def stop():
+            for server in self.servers:
+                server.close()
+
+        self._run(stop())
+        for sock in self.sockets:
+            sock.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"plain", "ssl", "refused", "blackholed"}
+    if unknown:
+        raise ValueError(f"unknown target kind(s): {', '.join(sorted(unknown))}")
+    return mix
+
+
+def build_kinds(server_count: int, mix: dict) -> list:
+    total = sum(mix.values())
+    kinds = []
+    for kind, weight in mix.items():
+        kinds += [kind] * round(server_count * weight / total)
+    kinds = (kinds + ["plain"] * server_count)[:server_count]
+    random.Random(server_count).shuffle(kinds)  # spread the kinds over the run, the same way every time
+    return kinds
+
+
+def write_config(work_dir: str, targets: Targets, server_count: int, mix: dict, timeout: int):
+    conf = copy.deepcopy(SerMon.defaults)
+    notification = conf["sermon"]["notification"]
+    notification["smtp"]["default"].update(host="127.0.0.1", port=targets.smtp_port, secure_mode="plain",
+                                           email="sermon@example.com")
+    notification["distribution_groups"] = {"default": {"smtp_server": "default",
+                                                       "recipients": ["ops@example.com"]}}
+    servers = []
+    for i, kind in enumerate(build_kinds(server_count, mix)):
+        servers.append({"name": f"bench {kind} {i}", "host": "127.0.0.1", "port": targets.open(kind),
+                        "conn_type": "ssl" if kind == "ssl" else "plain", "priority": "high", "timeout": timeout,
+                        "interval": 60, "slow_threshold": 0, "distribution_group": "default"})
+    conf["sermon"]["servers"] = servers
+    ConfQuick("sermon", conf, custom_file_path=f"{work_dir}/sermon-conf.yaml").save()
+
+
+def worker(work_dir: str):
+    """
+    Runs in a fresh process inside the scratch folder and prints the measurements as JSON
+    """
+    raise_file_limit(65536)
+
+    result = {}
+    start = time.perf_counter()
+    servers = SerMon.load_config()
+    result["load_config_s"] = time.perf_counter() - start
+    sample = servers[:20]
+    start = time.perf_counter()
+    for server in sample:
+        server.check_connection()
+    result["check_connection_ms"] = (time.perf_counter() - start) / len(sample) * 1000
+    result["peak_mb_load_check"] = peak_memory_mb()
+
+    conf = ConfQuick("sermon", SerMon.defaults)
+    count = max(len(servers), 20000)
+    start = time.perf_counter()
+    for i in range(count):
+        conf.get(f"sermon.servers.{i % len(servers)}.host")
+    result["get_per_s"] = count / (time.perf_counter() - start)
+
+    journal = SerMon.get_journal()
+    for i, server in enumerate(servers):
+        journal.record(server.name_norm, alert=True, last_alert=None, alert_start=None, alert_count=i + 1)
+    start = time.perf_counter()
+    journal.flush()
+    result["journal_flush_s"] = time.perf_counter() - start
+
+    for label in ("cycle_cold_s", "cycle_warm_s"):
+        start = time.perf_counter()
+        SerMon.check_all(servers)
+        result[label] = time.perf_counter() - start
+    SerMon.get_notifier().close()
+    result["peak_mb"] = peak_memory_mb()
+    print(json.dumps(result))
+
+
+def run(server_count: int, mix: dict, timeout: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="sermon-bench-") as work_dir:
+        for path in glob.glob(f"{REPO_DIR}/*.py"):
+            shutil.copy(path, work_dir)
+        targets = Targets(work_dir)
+        try:
+            targets.start_smtp()
+            write_config(work_dir, targets, server_count, mix, timeout)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", work_dir],
+                                 cwd=work_dir, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            result["emails"] = targets.smtp_messages
+            return result
+        finally:
+            targets.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("server_count", type=int, nargs="*", default=[100, 1000, 10000])
+    parser.add_argument("--mix", default="plain=80,ssl=10,refused=5,blackholed=5",
+                        help="relative share of each target kind")
+    parser.add_argument("--timeout", type=int, default=500, help="server timeout in milliseconds")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker)
+        return
+    mix = parse_mix(args.mix)
+    raise_file_limit(max(args.server_count) * 4 + 1024)
+    print(f"{'servers':>8} | {'load':>8} | {'get/s':>10} | {'journal':>8} | {'check':>8} | {'cycle':>8} | "
+          f"{'warm':>8} | {'peak load+check':>15} | {'peak':>8} | emails")
+    for n in args.server_count:
+        r = run(n, mix, args.timeout)
+        print(f"{n:>8} | {r['load_config_s']:7.3f}s | {r['get_per_s']:10.0f} | {r['journal_flush_s']:7.3f}s | "
+              f"{r['check_connection_ms']:6.2f}ms | {r['cycle_cold_s']:7.3f}s | {r['cycle_warm_s']:7.3f}s | "
+              f"{r['peak_mb_load_check'] or 0:13.1f}MB | {r['peak_mb'] or 0:6.1f}MB | {r['emails']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+The alert store evaluates a cycle in one pass, with numpy or row by row. Both have to make the same decisions as
+SerMon._process_result does for a server without a row
+
+usage: python -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AlertStore  # noqa: E402
+from AlertPolicy import AlertPolicy  # noqa: E402
+from AlertStore import AlertStore as Store  # noqa: E402
+from Journal import Journal  # noqa: E402
+from SerMon import SerMon  # noqa: E402
+
+
+def random_policies(rng: random.Random, count: int):
+    return [{"down_checks": rng.randint(1, 3), "recovery_checks": rng.randint(1, 3), "notify_first": rng.randint(1, 3),
+             "notify_every": rng.choice([0, 1, 2, 5]), "flap_high": 0} for _ in range(count)]
+
+
+def random_results(rng: random.Random, count: int):
+    # mostly runs of the same result so the streaks reach their thresholds
+    results, state = [], True
+    for _ in range(count):
+        if rng.random() < 0.3:
+            state = not state
+        results.append(state)
+    return results
+
+
+class TestEvaluate(unittest.TestCase):
+    servers = 200
+    cycles = 60
+
+    def assertSameItems(self, first: list, second: list, what: str):
+        # compares item by item, a diff of the whole lists takes minutes
+        self.assertEqual(len(first), len(second), what)
+        for i, (a, b) in enumerate(zip(first, second)):
+            self.assertEqual(a, b, f"{what}, item {i}")
+
+    def run_store(self, policies, results, use_numpy: bool):
+        store = Store()
+        rows = [store.add(AlertPolicy(**policy)) for policy in policies]
+        start = int(datetime(2024, 1, 1).timestamp())
+        masks = []
+        with mock.patch.object(AlertStore, "numpy", AlertStore.numpy if use_numpy else None):
+            for cycle in range(self.cycles):
+                masks.append(store.evaluate(rows, [r[cycle] for r in results], [start + cycle * 60] * len(rows)))
+        return masks, {name: list(column) for name, column in store._data.items()}
+
+    @unittest.skipIf(AlertStore.numpy is None, "numpy is not installed")
+    def test_numpy_matches_rows(self):
+        rng = random.Random(1)
+        policies = random_policies(rng, self.servers)
+        results = [random_results(rng, self.cycles) for _ in policies]
+        numpy_masks, numpy_columns = self.run_store(policies, results, True)
+        rows_masks, rows_columns = self.run_store(policies, results, False)
+        for cycle, (a, b) in enumerate(zip(numpy_masks, rows_masks)):
+            for mask in a:
+                self.assertSameItems(a[mask], b[mask], f"cycle {cycle}, {mask}")
+        for name in numpy_columns:
+            self.assertSameItems(numpy_columns[name], rows_columns[name], name)
+
+    def test_store_matches_objects(self):
+        rng = random.Random(2)
+        policies = random_policies(rng, self.servers)
+        results = [random_results(rng, self.cycles) for _ in policies]
+        store = Store()
+        finished = {}
+
+        def finish(server, success, message, now, stamp, was_flapping, notify_down, alert_over, changed=True):
+            finished[server.row is not None].append((server.name, bool(notify_down), bool(alert_over)))
+            return message
+
+        with mock.patch.object(SerMon, "_finish_result", finish), mock.patch.object(SerMon, "alert_store", None):
+            plain = [SerMon(name=f"s{i}", host="h", policy=p) for i, p in enumerate(policies)]
+        with mock.patch.object(SerMon, "_finish_result", finish), mock.patch.object(SerMon, "alert_store", store):
+            stored = [SerMon(name=f"s{i}", host="h", policy=p) for i, p in enumerate(policies)]
+        for cycle in range(self.cycles):
+            now = datetime(2024, 1, 1) + timedelta(minutes=cycle)
+            finished[False], finished[True] = [], []
+            with mock.patch.object(SerMon, "_finish_result", finish), mock.patch.object(SerMon, "alert_store", None):
+                for server, result in zip(plain, results):
+                    server._process_result(result[cycle], "", now)
+            with mock.patch.object(SerMon, "_finish_result", finish), mock.patch.object(SerMon, "alert_store", store):
+                SerMon._process_results(stored, [(result[cycle], "", now) for result in results])
+                state = [{f: getattr(s, f) for f in Journal.fields} for s in stored]
+            self.assertSameItems(finished[False], finished[True], f"cycle {cycle}")
+            with mock.patch.object(SerMon, "alert_store", None):
+                self.assertSameItems([{f: getattr(s, f) for f in Journal.fields} for s in plain], state,
+                                     f"cycle {cycle}")
+
+
+class TestRows(unittest.TestCase):
+
+    def test_removed_rows_are_reused(self):
+        store = Store()
+        rows = [store.add(AlertPolicy()) for _ in range(3)]
+        store.set("alert", rows[1], True, "%Y-%m-%d %H:%M:%S")
+        store.remove(rows[1])
+        self.assertEqual(store.add(AlertPolicy(down_checks=2)), rows[1])
+        self.assertEqual((len(store), store.free), (3, 0))
+        self.assertIsNone(store.get("alert", rows[1], "%Y-%m-%d %H:%M:%S"))
+        self.assertEqual(store._data["down_checks"][rows[1]], 2)
+
+    def test_reconfigure_keeps_the_row(self):
+        store = Store()
+        with mock.patch.object(SerMon, "alert_store", store):
+            server = SerMon(name="a", host="h", alert=True, alert_count=3)
+            for timeout in range(1000, 1005):
+                server._reconfigure({"name": "a", "host": "h", "timeout": timeout, "policy": {"down_checks": 2}}, {})
+            self.assertEqual((len(store), server.row), (1, 0))
+            self.assertEqual((server.alert, server.alert_count), (True, 3))
+            self.assertEqual(store._data["down_checks"][0], 2)
+            server._release_row()
+            self.assertEqual((server.row, server.alert, server.alert_count, store.free), (None, True, 3, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
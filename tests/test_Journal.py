@@ -0,0 +1,100 @@
+"""
+The journal keeps each server's alert state in the config file, one entry per server name
+
+usage: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ConfQuick import ConfQuick  # noqa: E402
+from Journal import Journal  # noqa: E402
+
+try:
+    import benedict
+except ImportError:  # reading and writing the file needs python-benedict (requirements.txt)
+    benedict = None
+
+
+@unittest.skipIf(benedict is None, "python-benedict is not installed")
+class TestJournal(unittest.TestCase):
+    defaults = {"sermon": {"timestamp_format": "%Y-%m-%d %H:%M:%S"}}
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.conf_file = os.path.join(self.folder, "sermon-conf.yaml")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self) -> Journal:
+        return Journal(ConfQuick("sermon", self.defaults, custom_file_path=self.conf_file))
+
+    def test_dotted_name_survives_a_reload(self):
+        journal = self.load()
+        journal.record("db.example.com", alert=True, alert_count=2, alert_start="2024-01-01 00:00:00")
+        journal.record("plain", alert=False, alert_count=0)
+        self.assertTrue(journal.flush())
+        journal = self.load()
+        self.assertEqual(journal.get("db.example.com")["alert_count"], 2)
+        self.assertIs(journal.get("db.example.com")["alert"], True)
+        self.assertEqual(journal.get("plain")["alert_count"], 0)
+        self.assertEqual(set(journal.conf.get("journal")), {"db.example.com", "plain"})
+
+    def test_nested_entries_are_migrated(self):
+        conf = ConfQuick("sermon", self.defaults, custom_file_path=self.conf_file)
+        conf.set("journal.db.example.com.alert", True, False)
+        conf.set("journal.db.example.com.alert_count", 3, False)
+        conf.save()
+        journal = self.load()
+        self.assertEqual(journal.get("db.example.com")["alert_count"], 3)
+        journal.record("db.example.com", **{**journal.get("db.example.com"), "alert_count": 4})
+        journal.flush()
+        journal = self.load()
+        self.assertEqual(journal.conf.get("journal"), {"db.example.com": journal.get("db.example.com")})
+        self.assertEqual(journal.get("db.example.com")["alert_count"], 4)
+
+    def test_taken_entries_stay_visible_and_return_on_failure(self):
+        journal = self.load()
+        journal.record("a", alert=True, alert_count=1)
+        entries = journal.take()
+        self.assertFalse(journal.dirty)
+        self.assertEqual(journal.get("a")["alert_count"], 1)  # read while another thread writes the file
+        journal.record("a", alert=True, alert_count=2)
+        journal.conf.conf_file = self.folder  # a folder cannot be replaced by the file
+        with self.assertRaises(OSError):
+            journal.write(entries)
+        self.assertEqual(journal.get("a")["alert_count"], 2)  # the newer change is not overwritten
+        journal.conf.conf_file = self.conf_file
+        self.assertTrue(journal.flush())
+        self.assertEqual(self.load().get("a")["alert_count"], 2)
+
+    def test_workers_share_the_store(self):
+        store = os.path.join(self.folder, "sermon-shard.db")
+        conf = ConfQuick("sermon", self.defaults, custom_file_path=self.conf_file)
+        conf.set("journal.b", {"alert": False, "alert_count": 7}, False)
+        conf.save()
+        mtime = os.path.getmtime(self.conf_file)
+        first = Journal(ConfQuick("sermon", self.defaults, custom_file_path=self.conf_file), store=store)
+        second = Journal(ConfQuick("sermon", self.defaults, custom_file_path=self.conf_file), store=store)
+        self.assertEqual(first.get("b")["alert_count"], 7)  # from the file until a worker writes a row
+        first.record("db.example.com", alert=True, alert_count=1)
+        self.assertTrue(first.flush())
+        self.assertTrue(second.refresh())
+        self.assertEqual(second.get("db.example.com")["alert_count"], 1)
+        self.assertFalse(second.refresh())
+        self.assertEqual(os.path.getmtime(self.conf_file), mtime)
+        first.close()
+        second.close()
+        journal = self.load()
+        self.assertEqual(journal.adopt(store), 1)
+        self.assertEqual(self.load().get("db.example.com")["alert_count"], 1)
+        self.assertEqual(journal.adopt(store), 0)  # moved, not copied
+
+
+if __name__ == "__main__":
+    unittest.main()